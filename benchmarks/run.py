@@ -0,0 +1,244 @@
+"""
+Benchmarks of the rootwater hot paths
+=====================================
+
+Run from the repository root::
+
+    python -m benchmarks.run                       # all benchmarks at the default scale
+    python -m benchmarks.run --scale large         # more days, sensors and trees
+    python -m benchmarks.run -k RWU --json new.json --compare old.json
+
+Every benchmark reports the best and median wall time of several repeats and the
+peak memory allocated through Python (tracemalloc) during one extra run. Results
+stored as JSON of two revisions can be compared with --compare. The import
+benchmarks time a fresh interpreter importing the package (import/python is the
+bare interpreter for reference).
+
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+import warnings
+
+import numpy as np
+
+from rootwater import rw, sf, vg
+from . import synthetic
+
+SCALES = {
+    'small': dict(days=14, sensors=3, trees=10, freq='30min'),
+    'default': dict(days=60, sensors=6, trees=60, freq='30min'),
+    'large': dict(days=365, sensors=20, trees=500, freq='10min'),
+}
+
+
+def _vg_conv():
+    # van Genuchten conversions of the example script
+    spec = importlib.util.spec_from_file_location('vG_conv', os.path.join(synthetic.EXAMPLES, 'vG_conv.py'))
+    vg = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(vg)
+    return vg
+
+
+def benchmarks(scale):
+    r"""Return a dict of benchmark names and setup functions returning the callable to time"""
+    days, sensors, trees, freq = scale['days'], scale['sensors'], scale['trees'], scale['freq']
+
+    def sm_synthetic():
+        return synthetic.soil_moisture(days, sensors, freq)
+
+    def sm_example():
+        return synthetic.example_soil_moisture()
+
+    def sv_synthetic():
+        return synthetic.sap_velocity(days, trees, freq)
+
+    def fRWU(method, data):
+        # method or the compiled kernels ('numba', warmed up before timing)
+        def setup():
+            ts = data().iloc[:, 0].tz_localize('Etc/GMT-1')
+            if method == 'numba':
+                rw.fRWU(ts, engine='numba')
+                return lambda: rw.fRWU(ts, engine='numba')
+            return lambda: rw.fRWU(ts, method=method, engine='numpy')
+        return setup
+
+    def dfRWUc(data, n_cols):
+        def setup():
+            df = data().iloc[:, :n_cols]
+            return lambda: rw.dfRWUc(df)
+        return setup
+
+    def sweepRWU(data, n_cols):
+        # 3 values of every parameter (81 parameter sets)
+        def setup():
+            df = data().iloc[:, :n_cols]
+            return lambda: rw.sweepRWU(df, diffx=[2, 3, 4], slope_diff=[2, 3, 4], maxdiffs=[0.1, 0.25, 0.5],
+                                       mintime=[3., 3.5, 4.])
+        return setup
+
+    def ensembleRWU(data, n_cols):
+        # 1000 members per sensor
+        def setup():
+            df = data().iloc[:, :n_cols].tz_localize('Etc/GMT-1')
+            return lambda: rw.ensembleRWU(df, n=1000, seed=1)
+        return setup
+
+    def sap_calc(data, r):
+        def setup():
+            SV = data().iloc[:, :3]
+            return lambda: sf.sap_calc(SV, r)
+        return setup
+
+    def sap_volume():
+        SV = sv_synthetic()
+        s1, s2 = SV.iloc[:, 1].values, SV.iloc[:, 0].values
+        return lambda: sf.sap_volume(32., s1, s2)
+
+    def gebauer_act():
+        r = np.random.RandomState(42).uniform(15., 45., trees)
+        return lambda: sf.gebauer_act(r)
+
+    def sap_stand():
+        SV = sv_synthetic()
+        inv = synthetic.inventory(trees)
+        return lambda: sf.sap_stand(SV, inv)
+
+    def vg_conv(func):
+        def setup():
+            vgc = _vg_conv()
+            p = synthetic.example_soil_params().iloc[:, :-1].astype(float)
+            theta = sm_synthetic().values
+            # the conversions of the example script take flat arrays (time x sensors raveled)
+            soil = np.arange(theta.shape[1]) % p.shape[1]
+            ths, thr, alpha, n = [np.broadcast_to(p.loc[k].values[soil], theta.shape).ravel()
+                                  for k in ['ths', 'thr', 'alpha', 'n']]
+            theta = np.clip(theta.ravel(), thr + 0.1, ths - 0.1)
+            if func == 'psi_theta':
+                return lambda: vgc.psi_theta(theta, ths, thr, alpha, n)
+            psi = vgc.psi_theta(theta, ths, thr, alpha, n)
+            return lambda: vgc.theta_psi(psi, ths, thr, alpha, n)
+        return setup
+
+    def vg_module(func, resolution=None):
+        def setup():
+            p = synthetic.example_soil_params().iloc[:, :-1].astype(float)
+            theta = sm_synthetic().values
+            # one soil per sensor column, broadcast over the (time steps x sensors) array
+            soil = np.arange(theta.shape[1]) % p.shape[1]
+            ths, thr, alpha, n = [p.loc[k].values[soil] for k in ['ths', 'thr', 'alpha', 'n']]
+            theta = np.clip(theta, thr + 0.1, ths - 0.1)
+            if resolution is None:
+                return lambda: vg.psi_theta(theta, ths, thr, alpha, n)
+            lut = vg.LookupTable(p.loc['ths'], p.loc['thr'], p.loc['ks'], p.loc['alpha'], p.loc['n'],
+                                 resolution=resolution)
+            if func == 'psi_theta':
+                return lambda: lut.psi_theta(theta, soil)
+            psi = vg.psi_theta(theta, ths, thr, alpha, n)
+            return lambda: lut.theta_psi(psi, soil)
+        return setup
+
+    def import_module(name):
+        # start up time of a fresh interpreter (as a worker process) importing name
+        def setup():
+            cmd = [sys.executable, '-c', 'import ' + name if name else 'pass']
+            return lambda: subprocess.run(cmd, check=True)
+        return setup
+
+    jit = {
+        'fRWU/numba/synthetic': fRWU('numba', sm_synthetic),
+        'fRWU/numba/example': fRWU('numba', sm_example),
+    } if importlib.util.find_spec('numba') else {}
+
+    return {
+        'import/python': import_module(''),
+        'import/rootwater': import_module('rootwater'),
+        'import/rootwater.rootwater': import_module('rootwater.rootwater'),
+        'import/rootwater.sapflow': import_module('rootwater.sapflow'),
+        'fRWU/numpy/synthetic': fRWU('numpy', sm_synthetic),
+        'fRWU/statsmodels/synthetic': fRWU('statsmodels', sm_synthetic),
+        'fRWU/numpy/example': fRWU('numpy', sm_example),
+        'dfRWUc/synthetic': dfRWUc(sm_synthetic, sensors),
+        'dfRWUc/example': dfRWUc(sm_example, sensors),
+        'sweepRWU/example': sweepRWU(sm_example, sensors),
+        'ensembleRWU/example': ensembleRWU(sm_example, sensors),
+        'sap_calc/synthetic': sap_calc(sv_synthetic, 32.),
+        'sap_calc/example': sap_calc(synthetic.example_sap_velocity, 32.),
+        'sap_volume/synthetic': sap_volume,
+        'gebauer_act/inventory': gebauer_act,
+        'sap_stand/synthetic': sap_stand,
+        'vG/psi_theta/synthetic': vg_conv('psi_theta'),
+        'vG/theta_psi/synthetic': vg_conv('theta_psi'),
+        'vangenuchten/psi_theta/synthetic': vg_module('psi_theta'),
+        'vangenuchten/lookup/psi_theta': vg_module('psi_theta', 1000),
+        'vangenuchten/lookup/theta_psi': vg_module('theta_psi', 1000),
+        **jit,
+    }
+
+
+def measure(func, repeat=3):
+    r"""Best and median wall time (s) of repeat calls and peak traced memory (MB) of one call"""
+    times = []
+    for i in np.arange(repeat):
+        t0 = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - t0)
+
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'best': min(times), 'median': float(np.median(times)), 'peak_mb': peak/1e6}
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Benchmarks of the rootwater hot paths')
+    parser.add_argument('--scale', choices=sorted(SCALES), default='default')
+    parser.add_argument('--days', type=int)
+    parser.add_argument('--sensors', type=int)
+    parser.add_argument('--trees', type=int)
+    parser.add_argument('--freq')
+    parser.add_argument('-k', dest='select', default='', help='only run benchmarks containing this string')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--json', help='store results in this file')
+    parser.add_argument('--compare', help='compare with results stored in this file')
+    args = parser.parse_args(argv)
+
+    scale = dict(SCALES[args.scale])
+    for k in scale:
+        if getattr(args, k) is not None:
+            scale[k] = getattr(args, k)
+    base = {}
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)['results']
+
+    print('scale: ' + ', '.join('%s=%s' % i for i in scale.items()))
+    print('%-28s %10s %10s %10s %9s' % ('benchmark', 'best (s)', 'median (s)', 'peak (MB)', 'speedup'))
+    results = {}
+    for name, setup in benchmarks(scale).items():
+        if args.select not in name:
+            continue
+        with warnings.catch_warnings(), contextlib.redirect_stdout(io.StringIO()):
+            warnings.simplefilter('ignore')
+            res = measure(setup(), args.repeat)
+        results[name] = res
+        speedup = '%8.2fx' % (base[name]['best']/res['best']) if name in base else ''
+        print('%-28s %10.4f %10.4f %10.2f %9s' % (name, res['best'], res['median'], res['peak_mb'], speedup))
+        sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'scale': scale, 'results': results}, f, indent=1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+"""
+Synthetic data for the rootwater benchmarks
+===========================================
+
+Generators of reproducible soil moisture and sap velocity records which scale 
+in the number of days, sensors, trees and the sampling frequency. The shapes 
+follow the diurnal dynamics rootwater is built for: soil moisture declines 
+during the day and stagnates at night, sap velocity follows the daylight.
+
+"""
+
+import os
+import numpy as np
+import pandas as pd
+
+# shipped example records used as realistic baselines
+EXAMPLES = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'docs', 'examples')
+
+
+def _daylight(index):
+    # relative daylight intensity (0 at night, 1 at noon) with daylight from 5 to 21 h
+    hours = index.hour + index.minute/60.
+    return np.clip(np.sin((np.asarray(hours) - 5.)/16.*np.pi), 0., None)
+
+
+def soil_moisture(n_days=30, n_sensors=3, freq='30min', tz='Etc/GMT-1', start='2017-06-01', seed=42):
+    r"""Soil moisture records (vol.%) of n_sensors with diurnal root water uptake steps
+
+    Returns
+    -------
+    SM : pandas.DataFrame
+        time zone naive data frame (as expected by rootwater.rootwater.dfRWUc) with 
+        one column per sensor
+    """
+    rng = np.random.RandomState(seed)
+    index = pd.date_range(start, periods=int(n_days*pd.Timedelta('1D')/pd.Timedelta(freq)), freq=freq)
+    light = _daylight(index)
+
+    SM = {}
+    for i in np.arange(n_sensors):
+        uptake = rng.uniform(0.1, 0.6)*light/light.sum()*n_days
+        rain = np.zeros(len(index))
+        rain[rng.choice(len(index), max(1, n_days//10), replace=False)] = rng.uniform(1., 4.)
+        noise = rng.normal(0., 0.005, len(index))
+        SM['SM_%03d' % i] = rng.uniform(15., 30.) - np.cumsum(uptake) + np.cumsum(rain) + noise
+    return pd.DataFrame(SM, index=index)
+
+
+def sap_velocity(n_days=30, n_trees=3, freq='30min', start='2017-06-01', seed=42):
+    r"""East30 sap velocity records (cm/h) at inner, mid and outer point of n_trees
+
+    Returns
+    -------
+    SV : pandas.DataFrame
+        data frame with the columns <tree>_SV_inner, <tree>_SV_mid, <tree>_SV_outer
+    """
+    rng = np.random.RandomState(seed)
+    index = pd.date_range(start, periods=int(n_days*pd.Timedelta('1D')/pd.Timedelta(freq)), freq=freq)
+    light = _daylight(index)
+
+    SV = {}
+    for i in np.arange(n_trees):
+        peak = rng.uniform(5., 15.)
+        for pos, fac in zip(['inner', 'mid', 'outer'], [0.6, 1., 0.8]):
+            SV['T%03d_SV_%s' % (i, pos)] = fac*peak*light + rng.normal(0., 0.3, len(index))
+    return pd.DataFrame(SV, index=index)
+
+
+def inventory(n_trees=3, seed=42):
+    r"""Tree inventory for rootwater.sapflow.sap_stand matching sap_velocity"""
+    rng = np.random.RandomState(seed)
+    ids = ['T%03d' % i for i in np.arange(n_trees)]
+    return pd.DataFrame({'r': rng.uniform(15., 45., n_trees), 'tree': 'beech',
+                         'inner': [i+'_SV_inner' for i in ids], 'mid': [i+'_SV_mid' for i in ids],
+                         'outer': [i+'_SV_outer' for i in ids]}, index=ids)
+
+
+def example_soil_moisture():
+    r"""Shipped soil moisture example record (docs/examples/soilmoisture.csv)"""
+    return pd.read_csv(os.path.join(EXAMPLES, 'soilmoisture.csv'), index_col=0, parse_dates=True)
+
+
+def example_sap_velocity():
+    r"""Shipped sap velocity example record (docs/examples/sapvelocity.csv)"""
+    return pd.read_csv(os.path.join(EXAMPLES, 'sapvelocity.csv'), index_col=0, parse_dates=True)
+
+
+def example_soil_params():
+    r"""Shipped van Genuchten parameters (docs/examples/vG_RWU.csv)"""
+    return pd.read_csv(os.path.join(EXAMPLES, 'vG_RWU.csv'), index_col=0)
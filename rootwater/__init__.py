@@ -1,2 +1,16 @@
-from . import rootwater as rw
-from . import sapflow as sf
\ No newline at end of file
+import importlib
+
+# submodules are imported on first access to keep the package import light
+# (e.g. a sap flow job never pays for the soil moisture dependencies)
+_submodules = {'rw': 'rootwater', 'sf': 'sapflow', 'store': 'store', 'vg': 'vangenuchten',
+               'rootwater': 'rootwater', 'sapflow': 'sapflow', 'vangenuchten': 'vangenuchten', 'cli': 'cli'}
+
+def __getattr__(name):
+    if name in _submodules:
+        module = importlib.import_module('.' + _submodules[name], __name__)
+        globals()[name] = module
+        return module
+    raise AttributeError('module ' + repr(__name__) + ' has no attribute ' + repr(name))
+
+def __dir__():
+    return sorted(list(globals()) + list(_submodules))
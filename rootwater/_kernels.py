@@ -0,0 +1,209 @@
+"""
+Compiled kernels
+================
+
+The day loop of rootwater.rootwater.fRWU (step detection, night and day fits and
+the step control) as one loop over float64 and int64 arrays, compiled with numba
+if it is installed (rwu_days is None otherwise).
+
+The loop repeats the arithmetic of the vectorized NumPy functions of
+rootwater.rootwater (_startstop_windows, _linfit_windows, _rwu_lines and
+_rwu_score) step by step, i.e. sums in sequence and quantiles interpolated as numpy.nanquantile, so
+that both give identical results. Time stamps are int64 ns and NaT is the
+smallest int64.
+"""
+import math
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+_NAT = np.iinfo(np.int64).min
+_H = 3600*10**9
+
+def _nearest(T, target, start, stop):
+    # position in T[start:stop] nearest to target (see rootwater.rootwater._nearest)
+    right = min(max(np.searchsorted(T, target), start), stop - 1)
+    left = min(max(right - 1, start), stop - 1)
+    dl = abs((T[left] - target) // 10**9)
+    dr = abs((T[right] - target) // 10**9)
+    if dl <= dr:
+        return left
+    return right
+
+def _quantile(v, n, q):
+    # quantile of the first n values of v with the linear interpolation of numpy.quantile
+    s = np.sort(v[:n])
+    vi = (n - 1) * q
+    if vi >= n - 1:
+        a = s[n - 1]
+        b = s[n - 1]
+    else:
+        a = s[int(math.floor(vi))]
+        b = s[int(math.floor(vi)) + 1]
+    g = vi - math.floor(vi)
+    d = b - a
+    if g >= 0.5:
+        return b - d * (1 - g)
+    return a + d * g
+
+def _linfit(y, start, stop):
+    # least squares line through the finite values of y[start:stop] (see _linfit_windows)
+    # returns slope, intercept and the number of values
+    n = 0
+    sx = 0.
+    sy = 0.
+    for i in range(start, stop):
+        if np.isfinite(y[i]):
+            n += 1
+            sx += i - start
+            sy += y[i]
+    if n == 0:
+        return np.nan, np.nan, 0
+    xm = sx / n
+    ym = sy / n
+    if n == 1:
+        return xm * ym / (1. + xm**2), ym / (1. + xm**2), 1
+    sxy = 0.
+    sxx = 0.
+    for i in range(start, stop):
+        if np.isfinite(y[i]):
+            dx = (i - start) - xm
+            sxy += dx * (y[i] - ym)
+            sxx += dx * dx
+    slope = sxy / sxx
+    return slope, ym - slope * xm, n
+
+def _rwu_days(dif, y, T, sunset_prev, sunrise, sunset, step, slope_diff, maxdiffs, mintime):
+    # dif : smoothed soil moisture change, y : soil moisture, T : time stamps
+    # sunset_prev, sunrise, sunset : solar references per day, step : time step (ns)
+    # returns positions of tin, tout and tix, the fallback reason, if the day could be
+    # processed, rwu, rwu_nonight, lm_night and lm_day (days x 4), step_control and if
+    # the end of the day is on the time step grid of the night
+    ndays = len(sunrise)
+    tin = np.zeros(ndays, dtype=np.int64)
+    tout = np.zeros(ndays, dtype=np.int64)
+    tix = np.zeros(ndays, dtype=np.int64)
+    reason = np.zeros(ndays, dtype=np.int64)
+    ok = np.zeros(ndays, dtype=np.bool_)
+    fits = np.full((ndays, 4), np.nan)
+    control = np.full(ndays, np.nan)
+    grid = np.zeros(ndays, dtype=np.bool_)
+    q = np.empty(len(dif))
+    steps6h = (6.*3600.) / ((step // 10**9) % 86400)
+
+    for d in range(ndays):
+        if (sunset_prev[d] == _NAT) | (sunrise[d] == _NAT) | (sunset[d] == _NAT):
+            continue
+        a = np.searchsorted(T, sunset_prev[d] - 5*_H)
+        b = max(a, np.searchsorted(T, sunset[d] + 2*_H, side='right'))
+        if b <= a:
+            continue
+        ok[d] = True
+
+        # first non-negative change, next decrease below -0.01 and next increase
+        i0 = -1
+        j = -1
+        k = -1
+        for c in range(a, b):
+            if (i0 < 0) & (dif[c] >= 0):
+                i0 = c
+            elif (i0 >= 0) & (j < 0) & (dif[c] <= -0.01):
+                j = c
+            elif (j >= 0) & (dif[c] > 0):
+                k = c
+                break
+
+        # reference limit from the decreases between the stops and the first centered
+        # rolling mean over 3 time steps below it
+        t = -1
+        if k >= 0:
+            nq = 0
+            for c in range(i0, k + 1):
+                if dif[c] < -0.001:
+                    q[nq] = dif[c]
+                    nq += 1
+            if nq > 0:
+                reflim = min(-0.001, _quantile(q, nq, 0.95))
+                for c in range(i0 + 1, b - 1):
+                    if (dif[c-1] + dif[c] + dif[c+1]) / 3. <= reflim:
+                        t = c
+                        break
+
+        if i0 < 0:
+            reason[d] = 1
+        elif j < 0:
+            reason[d] = 2
+        elif k < 0:
+            reason[d] = 3
+        elif t < 0:
+            reason[d] = 4
+        if reason[d] == 0:
+            tin[d] = i0
+            tout[d] = t
+            tix[d] = k
+        else:
+            tin[d] = _nearest(T, sunset_prev[d] + _H, a, b)
+            tout[d] = _nearest(T, sunrise[d] + 2*_H, a, b)
+            tix[d] = _nearest(T, sunset[d] + _H, a, b)
+
+        # first positions of the reference times (as located by time stamp in dayRWU)
+        pin = np.searchsorted(T, T[tin[d]])
+        pout = np.searchsorted(T, T[tout[d]])
+        pix = np.searchsorted(T, T[tix[d]])
+
+        # checks of min time spans (as datetime.timedelta.seconds) and differences
+        if ((((T[pout] - T[pin]) // 10**9) % 86400 < mintime*3600.) |
+                (((T[pix] - T[pout]) // 10**9) % 86400 < mintime*3600.)):
+            control[d] = 2
+            grid[d] = True
+            continue
+        exceed = False
+        for c in range(pin, pix + 1):
+            if dif[c] > maxdiffs:
+                exceed = True
+                break
+        if exceed:
+            control[d] = 3
+            grid[d] = True
+            continue
+
+        # night model on ts.loc[tin:tout-1h] and day model on ts.loc[tout:tix]
+        lm_n, ic_n, n_n = _linfit(y, pin, np.searchsorted(T, T[pout] - _H, side='right'))
+        lm_d, ic_d, n_d = _linfit(y, pout, pix + 1)
+        if n_n == 0:
+            control[d] = 0
+            grid[d] = True
+            continue
+        fits[d, 2] = lm_n
+        if n_d == 0:
+            control[d] = 0
+            grid[d] = True
+            continue
+
+        # night time extrapolation to tix (only defined on the sampling grid)
+        span = T[pix] - T[pin]
+        grid[d] = (span % step == 0) & (span >= 0)
+        fuse = ic_n + lm_n * (span / step)
+
+        # control of assumptions of a step
+        control[d] = (10*(lm_n/steps6h > -0.5/6.) + 100*(lm_n/steps6h < 1/6.)
+            + 1000*((lm_d < 0) & (lm_d/steps6h > -0.5/12.)) + 1*(lm_d < slope_diff*lm_n)
+            + 10000*(fuse - y[pix] < 2.))
+        fits[d, 0] = fuse - y[pix]
+        fits[d, 1] = y[pout] - y[pix]
+        fits[d, 3] = lm_d
+
+    return tin, tout, tix, reason, ok, fits, control, grid
+
+if numba is not None:
+    _jit = numba.njit(cache=True, nogil=True, error_model='numpy')
+    _nearest = _jit(_nearest)
+    _quantile = _jit(_quantile)
+    _linfit = _jit(_linfit)
+    rwu_days = _jit(_rwu_days)
+else:
+    rwu_days = None
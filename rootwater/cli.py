@@ -0,0 +1,331 @@
+"""
+The batch runner
+================
+
+Command line entry point to process the soil moisture and sap velocity records of
+many sites at once. A manifest lists the sites, every soil moisture sensor
+becomes an RWU job (rootwater.rootwater.fRWU) and every tree of an inventory a sap
+flow job (rootwater.sapflow.sap_stand). The jobs are scheduled across a pool of
+worker processes and the result of every job is written as soon as it is done
+with rootwater.store.write_results. An interrupted run is resumed by running the
+same command again, which skips all jobs with existing results. The jobs of a site
+are run in groups, which read the soil moisture or sap velocity file once and 
+share the solar plan (rootwater.rootwater.RWUPlan) of its time index::
+
+    rootwater network.json --jobs -1
+
+The manifest is a json file with the sites (paths relative to the manifest)::
+
+    {
+        "output": "results",
+        "format": "npz",
+        "sites": {
+            "Sand": {
+                "lat": 49.70764, "lon": 5.897638, "elev": 200.0, "tz": "Etc/GMT-1",
+                "soil_moisture": "soilmoisture.csv",
+                "columns": ["Sand_SM_10", "Sand_SM_30"],
+                "rwu": {"mintime": 3.5},
+                "sap_velocity": "sapvelocity.csv",
+                "inventory": {"Sand": {"r": 32.0, "tree": "beech", "inner": "Sand_SV_inner",
+                                       "mid": "Sand_SV_mid", "outer": "Sand_SV_outer"}}
+            }
+        }
+    }
+
+Soil moisture and sap velocity files are csv files with a datetime index in the
+first column (like the inputs of rootwater.rootwater.dfRWUc). All columns of the
+soil moisture file are processed if columns is missing, rwu holds further
+parameters of fRWU and the inventory (inline or a csv file indexed by tree id) is
+the one of sap_stand, optionally together with its perc. The results are written
+to <output>/<site>/rwu/<column> and <output>/<site>/sapflow/<tree> (indexed by
+time and id), so that rootwater.store.read_results of a directory gives the
+results of all sensors or trees of a site.
+
+.. note::
+    The RWU results are stored without the quality controls (safeRWU) of dfRWUc,
+    the step_control codes are stored instead.
+
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import re
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+def read_manifest(fname):
+    r"""Read a manifest of sites (see rootwater.cli)
+
+    Parameters
+    ----------
+    fname : str
+        json file of the manifest
+
+    Returns
+    -------
+    manifest : dict
+        the manifest with paths resolved relative to its directory
+    """
+    with open(fname) as f:
+        manifest = json.load(f)
+    if not isinstance(manifest.get('sites'), dict) or len(manifest['sites']) == 0:
+        raise ValueError('the manifest '+str(fname)+' has no sites')
+    base = os.path.dirname(os.path.abspath(fname))
+    path = lambda p: p if os.path.isabs(p) else os.path.join(base, p)
+    manifest['output'] = path(manifest.get('output', 'results'))
+    for site in manifest['sites'].values():
+        for k in ['soil_moisture', 'sap_velocity']:
+            if k in site:
+                site[k] = path(site[k])
+        if isinstance(site.get('inventory'), str):
+            site['inventory'] = path(site['inventory'])
+    return manifest
+
+def _safe(name):
+    # file name of a site, sensor or tree
+    return re.sub(r'[^\w.-]', '_', str(name))
+
+def _inventory(site):
+    # tree inventory of a site as in rootwater.sapflow.sap_stand
+    inventory = site['inventory']
+    if isinstance(inventory, str):
+        return pd.read_csv(inventory, index_col=0)
+    return pd.DataFrame.from_dict(inventory, orient='index')
+
+def make_jobs(manifest, format=None):
+    r"""List the RWU and sap flow jobs of a manifest
+
+    Parameters
+    ----------
+    manifest : dict
+        manifest (see rootwater.cli.read_manifest)
+    format : str
+        format of the result files (default the one of the manifest or 'npz')
+
+    Returns
+    -------
+    jobs : list of dict
+        one job per soil moisture sensor and tree with its result file (out)
+    """
+    format = format or manifest.get('format', 'npz')
+    jobs = []
+    for sid, site in manifest['sites'].items():
+        loc = dict(lat=site.get('lat', 49.70764), lon=site.get('lon', 5.897638), elev=site.get('elev', 200.))
+        tz = site.get('tz', 'Etc/GMT-1')
+        folder = os.path.join(manifest['output'], _safe(sid))
+        if 'soil_moisture' in site:
+            columns = site.get('columns') or list(pd.read_csv(site['soil_moisture'], index_col=0, nrows=0).columns)
+            params = dict(manifest.get('rwu', {}), **site.get('rwu', {}))
+            for c in columns:
+                jobs.append(dict(kind='rwu', site=sid, name=c, file=site['soil_moisture'], tz=tz, format=format,
+                                 params=dict(params, **loc), out=os.path.join(folder, 'rwu', _safe(c)+'.'+format)))
+        if ('sap_velocity' in site) & ('inventory' in site):
+            inventory = _inventory(site)
+            for tree in inventory.index:
+                jobs.append(dict(kind='sapflow', site=sid, name=tree, file=site['sap_velocity'], tz=tz, format=format,
+                                 params=dict(perc=site.get('perc', 0.95)), inventory=inventory.loc[[tree]],
+                                 out=os.path.join(folder, 'sapflow', _safe(tree)+'.'+format)))
+    return jobs
+
+def _read(fname, columns, tz):
+    # selected columns of a csv file with a datetime index in the first column
+    # (columns missing in the file are skipped)
+    header = pd.read_csv(fname, nrows=0).columns
+    df = pd.read_csv(fname, index_col=0, usecols=[header[0]] + [c for c in columns if c in header[1:]])
+    df.index = pd.to_datetime(df.index).tz_localize(tz)
+    return df
+
+def _columns(job):
+    # columns of the input file a job needs
+    if job['kind'] == 'rwu':
+        return [job['name']]
+    return list(job['inventory'][['inner', 'mid', 'outer']].values[0])
+
+def run_job(job, data=None, plan=None):
+    r"""Run one job of rootwater.cli.make_jobs and write its result
+
+    Parameters
+    ----------
+    job : dict
+        job of rootwater.cli.make_jobs
+    data : pandas.DataFrame
+        optional input of the job already read from its file
+    plan : rootwater.rootwater.RWUPlan
+        optional plan of the time index of data (RWU jobs)
+
+    Returns
+    -------
+    [records, failed] : list of int
+        number of processed records and of days (RWU) which could not be processed
+    """
+    from . import store
+    if data is None:
+        data = _read(job['file'], _columns(job), job['tz'])
+    missing = [c for c in _columns(job) if c not in data.columns]
+    if len(missing) > 0:
+        raise ValueError('columns not found in ' + job['file'] + ': ' + ', '.join(map(str, missing)))
+    if job['kind'] == 'rwu':
+        from .rootwater import fRWU
+        ts = data[job['name']]
+        # the per-day messages of fRWU are counted instead of printed
+        with contextlib.redirect_stdout(io.StringIO()):
+            [res, rep] = fRWU(ts, report=True, plan=plan, **job['params'])
+        res.index.name = 'time'
+        res = pd.concat({job['name']: res}, names=['id']).swaplevel()
+        [records, failed] = [len(ts), len(rep.failures)]
+    else:
+        from .sapflow import sap_stand
+        SV = data[_columns(job)]
+        res = sap_stand(SV, job['inventory'], **job['params'])
+        [records, failed] = [len(SV), 0]
+
+    # written under a temporary name first, so that an interrupted job leaves no result
+    os.makedirs(os.path.dirname(job['out']), exist_ok=True)
+    tmp = job['out'] + '.tmp'
+    store.write_results(res, tmp, format=job['format'])
+    os.replace(tmp, job['out'])
+    return [records, failed]
+
+def run_group(jobs):
+    r"""Run jobs of the same site, kind and input file (see rootwater.cli.run_job)
+
+    The input file is read once with the columns of all jobs and the RWU jobs share
+    one plan of its time index.
+
+    Returns
+    -------
+    results : list
+        [records, failed] (see rootwater.cli.run_job) or the exception of every job
+    """
+    job = jobs[0]
+    try:
+        data = _read(job['file'], list(dict.fromkeys(c for j in jobs for c in _columns(j))), job['tz'])
+        plan = None
+        if job['kind'] == 'rwu':
+            from .rootwater import RWUPlan
+            plan = RWUPlan(data.index, *[job['params'][k] for k in ['lat', 'lon', 'elev']])
+    except Exception as e:
+        return [e]*len(jobs)
+    results = []
+    for job in jobs:
+        try:
+            results.append(run_job(job, data, plan))
+        except Exception as e:
+            results.append(e)
+    return results
+
+def _groups(jobs, n_jobs):
+    # jobs of the same site, kind and file, where large groups are split to keep 
+    # n_jobs workers busy (every part reads the file once)
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job['site'], job['kind'], job['file']), []).append(job)
+    parts = max(1, n_jobs // max(1, len(groups)))
+    res = []
+    for g in groups.values():
+        k = min(parts, len(g))
+        res += [g[i*len(g)//k:(i+1)*len(g)//k] for i in range(k)]
+    return res
+
+def run(manifest, n_jobs=1, format=None, overwrite=False, log=sys.stderr):
+    r"""Run all jobs of a manifest (see rootwater.cli)
+
+    Parameters
+    ----------
+    manifest : dict or str
+        manifest or its json file
+    n_jobs : int
+        number of worker processes (1 runs sequentially, -1 uses all cores)
+    format : str
+        format of the result files ('npz', 'parquet' or 'feather', default the one of
+        the manifest or 'npz')
+    overwrite : bool
+        if True, jobs with existing results are run again (they are skipped otherwise)
+    log : file
+        stream for the progress (None for no output)
+
+    Returns
+    -------
+    summary : dict
+        numbers of jobs done, skipped and failed, records, time (s) and the errors of
+        the failed jobs
+    """
+    if isinstance(manifest, str):
+        manifest = read_manifest(manifest)
+    jobs = make_jobs(manifest, format)
+    todo = [j for j in jobs if overwrite or not os.path.exists(j['out'])]
+    summary = dict(jobs=len(jobs), done=0, skipped=len(jobs)-len(todo), failed=0, records=0, time=0., errors={})
+    say = (lambda msg: print(msg, file=log, flush=True)) if log is not None else (lambda msg: None)
+    say('%d jobs, %d with results skipped' % (len(jobs), summary['skipped']))
+
+    t0 = time.perf_counter()
+    def done(job, result, error=None):
+        key = '/'.join([str(job['site']), job['kind'], str(job['name'])])
+        elapsed = time.perf_counter() - t0
+        if error is None:
+            summary['done'] += 1
+            summary['records'] += result[0]
+            msg = '%d records' % result[0] + (', %d days failed' % result[1] if result[1] else '')
+        else:
+            summary['failed'] += 1
+            summary['errors'][key] = repr(error)
+            msg = 'failed: ' + repr(error)
+        n = summary['done'] + summary['failed']
+        say('[%d/%d] %s %s | %.2f jobs/s, %.0f records/s, %.0f s left' % (n, len(todo), key, msg,
+            n / elapsed, summary['records'] / elapsed, elapsed / n * (len(todo) - n)))
+
+    def finished(group, results):
+        for job, result in zip(group, results):
+            if isinstance(result, Exception):
+                done(job, None, result)
+            else:
+                done(job, result)
+
+    n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+    groups = _groups(todo, n_jobs)
+    if (n_jobs == 1) | (len(groups) < 2):
+        for group in groups:
+            finished(group, run_group(group))
+    else:
+        with ProcessPoolExecutor(max_workers=max(1, min(n_jobs, len(groups)))) as ex:
+            futures = dict((ex.submit(run_group, group), group) for group in groups)
+            for f in as_completed(futures):
+                try:
+                    finished(futures[f], f.result())
+                except Exception as e:
+                    finished(futures[f], [e]*len(futures[f]))
+    summary['time'] = time.perf_counter() - t0
+    say('%d done, %d skipped, %d failed, %d records in %.1f s' % (summary['done'], summary['skipped'],
+        summary['failed'], summary['records'], summary['time']))
+    return summary
+
+def main(argv=None):
+    r"""Console entry point (rootwater manifest.json, see rootwater --help)"""
+    parser = argparse.ArgumentParser(prog='rootwater', description='Process the RWU and sap flow jobs of a manifest of sites.')
+    parser.add_argument('manifest', help='json file with the sites (see the documentation of rootwater.cli)')
+    parser.add_argument('-j', '--jobs', type=int, default=-1, help='number of worker processes (default -1 for all cores)')
+    parser.add_argument('-o', '--output', help='directory of the results (overrides the manifest)')
+    parser.add_argument('-f', '--format', choices=['npz', 'parquet', 'feather'], help='format of the result files')
+    parser.add_argument('--overwrite', action='store_true', help='run jobs with existing results again')
+    parser.add_argument('--list', action='store_true', help='only list the jobs and their state')
+    parser.add_argument('-q', '--quiet', action='store_true', help='no progress output')
+    args = parser.parse_args(argv)
+
+    manifest = read_manifest(args.manifest)
+    if args.output is not None:
+        manifest['output'] = os.path.abspath(args.output)
+    if args.list:
+        for job in make_jobs(manifest, args.format):
+            print('%-8s %s/%s/%s %s' % ('done' if os.path.exists(job['out']) else 'todo', job['site'],
+                                        job['kind'], job['name'], job['out']))
+        return 0
+    summary = run(manifest, args.jobs, args.format, args.overwrite, None if args.quiet else sys.stderr)
+    return 1 if summary['failed'] > 0 else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -37,22 +37,567 @@ Submitted to Biogeosciences. DOI to be added
 
 import numpy as np
 import pandas as pd
-import statsmodels.formula.api as smf 
-import scipy.ndimage.filters as spf
-from scipy.signal import savgol_filter
+import contextlib
 import datetime
-from astral import LocationInfo
-from astral.sun import sun
-import hydroeval as he
+import functools
+import hashlib
+import itertools
+import os
+import time
+import warnings
+from concurrent.futures import ProcessPoolExecutor
+
+# statsmodels, scipy, astral and hydroeval are imported where they are needed
+# to keep the import of the module fast (e.g. for short-lived worker processes)
 
 # helper
 def nearby(ts,tx):
     return(np.argmin(np.abs((ts-tx).seconds+(ts-tx).days*86400.)))
     #likely never used...
 
+def _gather(y, start, stop):
+    # (windows x max. window length) matrix of y[start:stop] for many windows, padded with NaN
+    start = np.asarray(start, dtype=int)
+    length = np.maximum(np.asarray(stop, dtype=int) - start, 0)
+    width = length.max() if len(length) else 0
+    col = np.arange(width)
+    idx = np.clip(start[:, None] + col[None, :], 0, max(len(y) - 1, 0))
+    inside = col[None, :] < length[:, None]
+    if len(y) == 0:
+        return np.full(inside.shape, np.nan), inside
+    return np.where(inside, y[idx], np.nan), inside
+
+def _seqsum(X):
+    # row sums added up in sequence (as a loop would, see rootwater._kernels)
+    if X.shape[1] == 0:
+        return np.zeros(X.shape[0])
+    return np.cumsum(X, axis=1)[:, -1]
+
+def _linfit_windows(y, start, stop):
+    # closed-form least squares line y = intercept + slope*x through y[start:stop]
+    # for many windows at once (x counts the time steps from the window start).
+    # NaN values are dropped like in the statsmodels formula interface.
+    Y = _gather(y, start, stop)[0]
+    x = np.arange(Y.shape[1], dtype=float)
+    valid = np.isfinite(Y)
+    n = valid.sum(axis=1)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xm = _seqsum(np.where(valid, x, 0.)) / n
+        ym = _seqsum(np.where(valid, Y, 0.)) / n
+        dx = np.where(valid, x[None, :] - xm[:, None], 0.)
+        dy = np.where(valid, Y - ym[:, None], 0.)
+        slope = _seqsum(dx * dy) / _seqsum(dx * dx)
+        intercept = ym - slope * xm
+
+    # a single point gives the minimum norm solution (as the pseudo-inverse in statsmodels)
+    single = n == 1
+    if single.any():
+        x0 = np.where(valid[single], x, 0.).sum(axis=1)
+        y0 = np.where(valid[single], Y[single], 0.).sum(axis=1)
+        intercept[single] = y0 / (1. + x0**2)
+        slope[single] = x0 * y0 / (1. + x0**2)
+
+    return slope, intercept, n
+
+def _nearest(T, target, start, stop):
+    # position of the time stamp in T[start:stop] nearest to target (all int64 ns) with 
+    # the rounding and tie breaking of nearby (distance floored to seconds, first wins)
+    right = np.clip(np.searchsorted(T, target, side='left'), start, stop - 1)
+    left = np.clip(right - 1, start, stop - 1)
+    dl = np.abs(np.floor_divide(T[left] - target, 10**9))
+    dr = np.abs(np.floor_divide(T[right] - target, 10**9))
+    return np.where(dl <= dr, left, right)
+
+# reasons why the step detection falls back to the astronomical references
+_FALLBACKS = {1: 'no non-negative soil moisture change after sunset',
+              2: 'no soil moisture decrease below -0.01 after the night',
+              3: 'no soil moisture increase after the day',
+              4: 'no decrease below the reference limit'}
+
+def _window_bounds(T, sunset_prev, sunrise, sunset):
+    # positions of the step detection window per day (5 h before the previous sunset
+    # until 2 h after sunset) and if the day can be processed at all
+    h = 3600*10**9
+    ok = (sunset_prev != pd.NaT.value) & (sunrise != pd.NaT.value) & (sunset != pd.NaT.value)
+    a = np.searchsorted(T, sunset_prev - 5*h, side='left')
+    b = np.searchsorted(T, sunset + 2*h, side='right')
+    b = np.where(ok, np.maximum(a, b), a)
+    return [a, b, ok & (b > a)]
+
+def _startstop_windows(dif, T, sunset_prev, sunrise, sunset, bounds=None):
+    # batched step detection of fRWU (startstopRWU) for all days at once
+    # dif : smoothed soil moisture change, T : time stamps (int64 ns)
+    # sunset_prev, sunrise, sunset : solar references per day (int64 ns, NaT for missing)
+    # bounds : optional precomputed _window_bounds
+    # returns positions of tin, tout, tix in T, evalx, the fallback reason (0 for none) 
+    # and if the day could be processed at all
+    h = 3600*10**9
+    [a, b, ok] = _window_bounds(T, sunset_prev, sunrise, sunset) if bounds is None else bounds
+    M, inside = _gather(dif, a, b)
+    col = np.arange(M.shape[1])[None, :]
+    
+    def first(mask):
+        # first column of mask per day (-1 if none, also for windows without samples)
+        if mask.shape[1] == 0:
+            return np.full(mask.shape[0], -1)
+        return np.where(mask.any(axis=1), np.argmax(mask, axis=1), -1)
+    
+    with np.errstate(invalid='ignore'):
+        i0 = first(M >= 0)
+        j = first((M <= -0.01) & (col > i0[:, None]) & (i0[:, None] >= 0))
+        k = first((M > 0) & (col > j[:, None]) & (j[:, None] >= 0))
+        
+        # reference limit from the decreases between the stops
+        Q = np.where((col >= i0[:, None]) & (col <= k[:, None]) & (M < -0.001), M, np.nan)
+        q = np.full(len(a), np.nan)
+        hasq = (k >= 0) & np.isfinite(Q).any(axis=1)
+        if hasq.any():
+            q[hasq] = np.nanquantile(Q[hasq], 0.95, axis=1)
+        reflim = np.minimum(-0.001, q)
+        
+        # centered rolling mean over 3 time steps from the first stop on
+        R = np.full(M.shape, np.nan)
+        R[:, 1:-1] = (M[:, :-2] + M[:, 1:-1] + M[:, 2:]) / 3.
+        t = first((R <= reflim[:, None]) & (col - 1 >= i0[:, None]) & (i0[:, None] >= 0))
+    
+    reason = np.where(i0 < 0, 1, np.where(j < 0, 2, np.where(k < 0, 3, np.where(t < 0, 4, 0))))
+    
+    # fallback to 1 hour after sunset, 2 hours after sunrise and 1 hour after sunset
+    tin = np.where(reason == 0, a + i0, _nearest(T, sunset_prev + h, a, b))
+    tout = np.where(reason == 0, a + t, _nearest(T, sunrise + 2*h, a, b))
+    tix = np.where(reason == 0, a + k, _nearest(T, sunset + h, a, b))
+    evalx = (reason == 0).astype(int)
+    return tin, tout, tix, evalx, reason, ok
+
+def _rowsum(X, valid):
+    # row sums over the valid entries with the same (pairwise) summation as np.sum on 
+    # each compressed row, so that near constant rows round as in the per-day reference
+    order = np.argsort(~valid, axis=1, kind='stable')
+    X = np.take_along_axis(X, order, axis=1)
+    count = valid.sum(axis=1)
+    res = np.zeros(len(X))
+    for c in np.unique(count[count > 0]):
+        rows = count == c
+        res[rows] = np.ascontiguousarray(X[rows, :c]).sum(axis=1)
+    return res
+
+def _step_nse(y, T, step, pin, pout, pix, lo, hi):
+    # bounded NSE (as hydroeval.nse_c2m) of the observations y in [lo, hi] against the 
+    # idealised step of fRWU for all days at once (time stamps T, step, lo and hi in int64 ns)
+    # the step starts at y[pin] at T[pin], rises to y[pin]+0.01 one hour after T[pout], 
+    # falls to y[pix] 2.5 hours before T[pix], and is linear in between and constant after
+    # only days with distinct anchors on the time step grid are evaluated (fast), the 
+    # others are left to the pandas reference in fRWU
+    h = 3600*10**9
+    t0 = T[pin]
+    n = np.where(T[pix] >= t0, (T[pix] - t0) // step + 1, 0)
+    a1 = T[pout] + h - t0
+    a2 = T[pix] - 5*h//2 - t0
+    m1 = a1 // step
+    m2 = a2 // step
+    v0 = y[pin]
+    v1 = y[pin] + 0.01
+    v2 = y[pix]
+    fast = ((a1 % step == 0) & (a2 % step == 0) & (m1 > 0) & (m2 > 0) & (m1 < n) & (m2 < n)
+            & (m1 != m2))
+    nse = np.full(len(pin), np.nan)
+    if not fast.any():
+        return nse, fast
+
+    [n, t0, lo, hi] = [x[fast] for x in [n, t0, lo, hi]]
+    m = np.arange(n.max())[None, :]
+    inside = m < n[:, None]
+    rows = np.arange(len(n))
+    A = np.full(inside.shape, np.nan)
+    A[rows, 0] = v0[fast]
+    A[rows, m1[fast]] = v1[fast]
+    A[rows, m2[fast]] = v2[fast]
+
+    # linear interpolation between the (finite) anchors as pandas.Series.interpolate,
+    # i.e. np.interp with leading gaps kept and trailing gaps filled with the last anchor
+    has = np.isfinite(A)
+    prev = np.maximum.accumulate(np.where(has, m, -1), axis=1)
+    nxt = np.minimum.accumulate(np.where(has, m, A.shape[1])[:, ::-1], axis=1)[:, ::-1]
+    vprev = np.take_along_axis(A, np.maximum(prev, 0), axis=1)
+    vnext = np.take_along_axis(A, np.minimum(nxt, A.shape[1] - 1), axis=1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        ideal = np.where(has, A, np.where(prev < 0, np.nan, np.where(nxt >= A.shape[1], vprev,
+                         ((vnext - vprev) / (nxt - prev)) * (m - prev) + vprev)))
+
+    # observations on the grid of the idealised step
+    G = t0[:, None] + m*step
+    q = np.clip(np.searchsorted(T, G), 0, len(T) - 1)
+    obs = y[q]
+    valid = inside & (T[q] == G) & (G >= lo[:, None]) & (G <= hi[:, None]) & np.isfinite(obs) & np.isfinite(ideal)
+
+    with np.errstate(invalid='ignore', divide='ignore'):
+        count = valid.sum(axis=1)
+        mean = _rowsum(ideal, valid) / count
+        num = _rowsum((ideal - obs)**2, valid)
+        den = _rowsum((ideal - mean[:, None])**2, valid)
+        nse_ = 1 - num / den
+        nse[fast] = nse_ / (2 - nse_)
+    return nse, fast
+
+def _rwu_lines(y, T, pin, pout, pix):
+    # night and day models of dayRWU in fRWU for many days at once
+    # y : soil moisture, T : time stamps (int64 ns), pin, pout, pix : positions of tin, 
+    # tout, tix; returns slope, intercept and number of values of the night and day
+    h = 3600*10**9
+    
+    # night model on ts.loc[tin:tout-1h] and day model on ts.loc[tout:tix]
+    lm_n, ic_n, n_n = _linfit_windows(y, pin, np.searchsorted(T, T[pout] - h, side='right'))
+    lm_d, ic_d, n_d = _linfit_windows(y, pout, pix+1)
+    return [lm_n, ic_n, n_n, lm_d, ic_d, n_d]
+
+def _exceeds(dif, start, stop, maxdiffs):
+    # if the smoothed soil moisture change exceeds maxdiffs in dif[start:stop+1]
+    exceed = np.concatenate([[0], np.cumsum(dif > maxdiffs)])
+    return (exceed[stop+1] - exceed[start]) > 0
+
+def _rwu_score(lines, y, T, step, pin, pout, pix, exceeds, slope_diff=3, mintime=3.5):
+    # closed-form counterpart of the checks and the step control of dayRWU in fRWU for 
+    # the _rwu_lines of many days (the thresholds only enter here)
+    # step : time step of the series (ns), exceeds : result of _exceeds with maxdiffs
+    # returns rwu, rwu_nonight, lm_night, lm_day, step_control and if the end of the 
+    # day is on the time step grid of the night
+    [lm_n, ic_n, n_n, lm_d, ic_d, n_d] = lines
+    lm_n = lm_n.copy()
+    lm_d = lm_d.copy()
+
+    # night time extrapolation to tix (only defined on the sampling grid)
+    span = T[pix] - T[pin]
+    fsteps = span / step
+    ongrid = (span % step == 0) & (span >= 0)
+    fuse = ic_n + lm_n*fsteps
+
+    # control of assumptions of a step (see dayRWU)
+    steps6h = (6.*3600.)/((step // 10**9) % 86400)
+    with np.errstate(invalid='ignore'):
+        step_control = (10*(lm_n/steps6h > -0.5/6.) + 100*(lm_n/steps6h < 1/6.)
+            + 1000*((lm_d < 0) & (lm_d/steps6h > -0.5/12.)) + 1*(lm_d < slope_diff*lm_n)
+            + 10000*(fuse-y[pix] < 2.)).astype(float)
+    rwu = fuse-y[pix]
+    rwu_nonight = y[pout]-y[pix]
+
+    # failed checks and fits in reverse order of dayRWU, so that the first one rules
+    # (durations in seconds of the day as datetime.timedelta.seconds)
+    seconds = lambda a, b: ((T[b] - T[a]) // 10**9) % 86400
+    reached = np.ones(len(pin), dtype=bool)
+    for fail, code in [(n_d == 0, 0), (n_n == 0, 0), (exceeds, 3),
+                       ((seconds(pin, pout) < mintime*3600.) | (seconds(pout, pix) < mintime*3600.), 2)]:
+        rwu[fail] = np.nan
+        rwu_nonight[fail] = np.nan
+        lm_d[fail] = np.nan
+        if code > 0:
+            lm_n[fail] = np.nan
+        step_control[fail] = code
+        reached[fail] = False
+    lm_n[n_n == 0] = np.nan
+    
+    # the night extrapolation is only evaluated (and required) with valid fits
+    return [rwu, rwu_nonight, lm_n, lm_d, step_control, ongrid | ~reached]
+
+def _kernel(required=False):
+    # the compiled day loop of rootwater._kernels (None without numba)
+    from rootwater import _kernels
+    if required and (_kernels.rwu_days is None):
+        raise ImportError("numba is required for engine='numba', use engine='numpy' instead")
+    return _kernels.rwu_days
+
+def _nanfilter(filt, X, radius):
+    # linear filter along the first axis of X with missing values: the filter runs on 
+    # zero-filled values and results with a NaN within radius are masked explicitly 
+    # (the same as NaN propagating through the filter, but without NaN arithmetic)
+    nan = np.isnan(X)
+    if not nan.any():
+        return filt(X)
+    from scipy.ndimage import maximum_filter1d
+    Y = filt(np.where(nan, 0., X))
+    Y[maximum_filter1d(nan, 2*radius + 1, axis=0)] = np.nan
+    return Y
+
+def smoothed_change(SM, diffx=3):
+    r"""Smoothed soil moisture change as evaluated by rootwater.rootwater.fRWU
+
+    The difference over diffx time steps smoothed with a gaussian filter (sigma of one 
+    time step) along the time axis, for one or many sensors at once. The change is 
+    missing where a difference within four time steps (the reach of the filter) is 
+    missing, e.g. at the start of the series and around gaps.
+
+    Parameters
+    ----------
+    SM : array_like
+        soil moisture (time steps) or (time steps x sensors), e.g. a pandas.DataFrame
+    diffx : int
+        number of time steps to evaluate change in moisture to (spans window)
+
+    Returns
+    -------
+    dif : numpy.ndarray
+        smoothed change of the shape of SM (NaN for missing differences)
+    """
+    from scipy.ndimage import gaussian_filter1d
+    X = np.asarray(SM, dtype=float)
+    D = np.full(X.shape, np.nan)
+    D[diffx:] = X[diffx:] - X[:-diffx]
+    return _nanfilter(lambda x: gaussian_filter1d(x, 1, axis=0), D, 4)
+
+def _savgol(X, window=15, polyorder=1):
+    # Savitzky-Golay filter along the time axis of (time steps x sensors), applied to 
+    # every run of finite values separately (runs shorter than the window are kept)
+    from scipy.signal import savgol_filter
+    Y = X.copy()
+    nan = np.isnan(X)
+    full = ~nan.any(axis=0)
+    if full.any() and (len(X) >= window):
+        Y[:, full] = savgol_filter(X[:, full], window, polyorder, axis=0)
+    for j in np.where(~full)[0]:
+        edges = np.diff(np.concatenate([[0], (~nan[:, j]).astype(np.int8), [0]]))
+        for a, b in zip(np.where(edges == 1)[0], np.where(edges == -1)[0]):
+            if b - a >= window:
+                Y[a:b, j] = savgol_filter(X[a:b, j], window, polyorder)
+    return Y
+
+def _rwu_arrays(n):
+    # preallocated fRWU output of n days: rates and slopes (rwu, rwu_nonight, lm_night, 
+    # lm_day, eval_nse), QC codes (step_control, evalx) with a mask of the known codes 
+    # and positions of the window times (tin, tout, tix) in the time series (-1 for none)
+    return [np.full((n, 5), np.nan), np.zeros((n, 2), dtype=np.int16), np.zeros((n, 2), dtype=bool), 
+            np.full((n, 3), -1)]
+
+def _rwu_frame(days, tindex, rates, codes, known, tpos):
+    # assemble the typed fRWU output at once (tindex is the index of the time series)
+    times = [tindex.take(tpos[:, j], allow_fill=True).array for j in range(3)]
+    return pd.DataFrame({'rwu': rates[:, 0], 'rwu_nonight': rates[:, 1], 'lm_night': rates[:, 2], 
+                         'lm_day': rates[:, 3], 
+                         'step_control': pd.arrays.IntegerArray(codes[:, 0], ~known[:, 0]),
+                         'evalx': pd.arrays.IntegerArray(codes[:, 1], ~known[:, 1]),
+                         'eval_nse': rates[:, 4], 'tin': times[0], 'tout': times[1], 'tix': times[2]},
+                        index=days)
+
+# solar references
+
+@functools.lru_cache(maxsize=64)
+def _solar_table(lat, lon, elev, tz, start, end):
+    # sunrise and sunset for all dates from start to end (inclusive) as UTC datetime64
+    # (at the microsecond resolution of astral)
+    from astral import LocationInfo
+    from astral.sun import sun
+
+    l = LocationInfo()
+    l.latitude = lat
+    l.longitude = lon
+    l.timezone = tz
+    l.elevation = elev
+
+    dates = pd.date_range(start, end, freq='D')
+    sunrise = np.full(len(dates), np.datetime64('NaT'), dtype='datetime64[us]')
+    sunset = sunrise.copy()
+    for i, dd in enumerate(dates.date):
+        try:
+            sx = sun(l, date=dd)
+        except ValueError:
+            # no sunrise or sunset at this date (polar day or night)
+            continue
+        sunrise[i] = pd.to_datetime(sx['sunrise']).tz_convert('UTC').tz_localize(None).to_datetime64()
+        sunset[i] = pd.to_datetime(sx['sunset']).tz_convert('UTC').tz_localize(None).to_datetime64()
+    return dates.values.astype('datetime64[D]'), sunrise, sunset
+
+
+def solar_table(lat, lon, elev, tz, start, end, cache_dir=None):
+    r"""Sunrise and sunset reference table for a site
+
+    Returns the astral sunrise and sunset times for every date between start and end.
+    The table is calculated once per site and date range and kept in memory (least
+    recently used tables are dropped) so that all sensors of a site share their 
+    astronomy.
+
+    Parameters
+    ----------
+    lat : float 
+        latitude of location (degree)
+    lon : float 
+        longitude of location (degree)
+    elev : float
+        elevation at location (m above msl)
+    tz : str
+        time zone of the returned times (astral/pytz nomenclature)
+    start, end : datetime.date or str
+        first and last date of the table
+    cache_dir : str
+        optional directory to persist the table as .npz file and to read it from
+        in later sessions
+
+    Returns
+    -------
+    table : pandas.DataFrame
+        data frame indexed by date with the columns sunrise and sunset (time zone 
+        aware, NaT at dates without sunrise or sunset)
+    """
+    key = (float(lat), float(lon), float(elev), str(tz), pd.Timestamp(start).date(), pd.Timestamp(end).date())
+
+    fname = None
+    if cache_dir is not None:
+        fname = os.path.join(cache_dir, 'solar_' + hashlib.md5(repr(key).encode()).hexdigest() + '.npz')
+    if (fname is not None) and os.path.exists(fname):
+        with np.load(fname) as npz:
+            [dates, sunrise, sunset] = [npz['dates'], npz['sunrise'], npz['sunset']]
+    else:
+        [dates, sunrise, sunset] = _solar_table(*key)
+        if fname is not None:
+            os.makedirs(cache_dir, exist_ok=True)
+            np.savez(fname, dates=dates, sunrise=sunrise, sunset=sunset)
+
+    table = pd.DataFrame({'sunrise': pd.DatetimeIndex(sunrise).tz_localize('UTC').tz_convert(key[3]),
+                          'sunset': pd.DatetimeIndex(sunset).tz_localize('UTC').tz_convert(key[3])},
+                         index=pd.DatetimeIndex(dates.astype('datetime64[s]')))
+    return table
+
+# instrumentation
+
+class RWUReport(object):
+    r"""Per-stage timing and per-day failure report of rootwater.rootwater.fRWU
+
+    Collects the wall time and number of calls of the processing stages (exclusive of
+    nested stages), the processing time per day and the reasons why days could not 
+    be processed or why the step detection fell back to astronomical references.
+    A disabled report does not measure anything.
+
+    Attributes
+    ----------
+    timings : dict
+        stage name and accumulated wall time (s)
+    calls : dict
+        stage name and number of calls
+    days : dict
+        date and wall time (s) spent in the processing of this day
+    failures : dict
+        date and reason why the day could not be processed
+    fallbacks : dict
+        date and reason why the step detection used the sunrise/sunset references
+    """
+
+    def __init__(self, enabled=True):
+        self.enabled = enabled
+        self.timings = {}
+        self.calls = {}
+        self.days = {}
+        self.failures = {}
+        self.fallbacks = {}
+        self._stack = []
+
+    def stage(self, name):
+        # context manager timing a stage (a no-op for a disabled report)
+        if not self.enabled:
+            return contextlib.nullcontext()
+        return self._timer(name)
+
+    @contextlib.contextmanager
+    def _timer(self, name):
+        t0 = time.perf_counter()
+        if self._stack:
+            # pause the enclosing stage
+            parent = self._stack[-1]
+            self.timings[parent[0]] = self.timings.get(parent[0], 0.) + t0 - parent[1]
+        self._stack.append([name, t0])
+        try:
+            yield
+        finally:
+            t1 = time.perf_counter()
+            [name, t0] = self._stack.pop()
+            self.timings[name] = self.timings.get(name, 0.) + t1 - t0
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if self._stack:
+                self._stack[-1][1] = t1
+
+    def summary(self):
+        r"""Return the stage timings as pandas.DataFrame sorted by their share of the total time"""
+        df = pd.DataFrame({'time': pd.Series(self.timings, dtype=float), 'calls': pd.Series(self.calls, dtype=int)})
+        df['share'] = df.time / df.time.sum()
+        return df.sort_values('time', ascending=False)
+
+    def __repr__(self):
+        return 'RWUReport(%.3f s in %i stages, %i days, %i failures, %i fallbacks)' % (
+            sum(self.timings.values()), len(self.timings), len(self.days), len(self.failures), len(self.fallbacks))
+
+class RWUPlan(object):
+    r"""References of rootwater.rootwater.fRWU which only depend on the time index
+
+    Sensors of a site share the time index, so that the days, the time step, the 
+    solar references and the positions of the daily search windows are computed 
+    once and every sensor only adds the arithmetic on its values (see 
+    rootwater.rootwater.dfRWUc which shares one plan with all columns).
+
+    Parameters
+    ----------
+    index : pandas.DatetimeIndex
+        time zone aware index of the soil moisture time series
+    lat : float 
+        latitude of location (degree)
+    lon : float 
+        longitude of location (degree)
+    elev : float
+        elevation at location (m above msl)
+    report : rootwater.rootwater.RWUReport
+        optional report timing the stages of the plan
+
+    Attributes
+    ----------
+    days : numpy.ndarray
+        dates of the index (datetime.date, the last one is not evaluated)
+    step : pandas.Timedelta
+        most frequent time step
+    solar : pandas.DataFrame
+        sunrise and sunset of the days and the day before (see rootwater.rootwater.solar_table)
+    T : numpy.ndarray
+        time stamps as int64 ns
+    sunset_prev, sunrise, sunset : numpy.ndarray
+        solar references (int64 ns) of the evaluated days
+    bounds : list of numpy.ndarray
+        start and stop positions of the step detection window of every day and if 
+        the day can be processed
+    idstep : list of numpy.ndarray
+        positions of the idealised step references (tin, tout, tix) of every day
+
+    Examples
+    --------
+    >>> plan = RWUPlan(SM.index, lat=49.70764, lon=5.897638, elev=200.)
+    >>> res = [fRWU(SM[i], plan=plan) for i in SM.columns]
+    """
+
+    def __init__(self, index, lat=49.70764, lon=5.897638, elev=200., report=None):
+        rep = RWUReport(enabled=False) if report is None else report
+        self.index = index
+        with rep.stage('days'):
+            # the days of ts.resample('1d') and the most frequent time step
+            self.days = pd.Series(np.zeros(len(index)), index=index).resample('1d').size().index.date
+            self.step = (pd.Series(index[1:]) - pd.Series(index[:-1])).value_counts().index[0]
+        with rep.stage('solar'):
+            self.solar = solar_table(lat, lon, elev, str(index.tz), self.days[0]-datetime.timedelta(days=1), self.days[-1])
+        with rep.stage('days'):
+            self.T = index.as_unit('ns').asi8
+            sunrise = pd.DatetimeIndex(self.solar.sunrise).as_unit('ns').asi8
+            sunset = pd.DatetimeIndex(self.solar.sunset).as_unit('ns').asi8
+            iday = self.solar.index.get_indexer(pd.DatetimeIndex(self.days[:-1]))
+            [self.sunset_prev, self.sunrise, self.sunset] = [sunset[iday-1], sunrise[iday], sunset[iday]]
+            self.bounds = _window_bounds(self.T, self.sunset_prev, self.sunrise, self.sunset)
+        with rep.stage('idstep'):
+            h = 3600*10**9
+            self.idstep = [_nearest(self.T, x, 0, len(self.T)) for x in 
+                           [self.sunset_prev - 3*h//2, self.sunrise + 2*h, self.sunset - h//2]]
+        self.unique = index.is_unique
+
+    def __len__(self):
+        return len(self.days)
+
+    def __repr__(self):
+        return 'RWUPlan(%i days, step %s)' % (len(self.days), self.step)
+
 # function to calculate change in soil moisture as root water uptake
 
-def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdiffs=0.25, mintime=3.5):
+def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdiffs=0.25, mintime=3.5, method='numpy', engine='auto', plan=None, dif=None, thresholds=None, report=False):
     r"""Calulate a daily root water uptake estimate from a soil moisture time series
 
     Returns a data frame with time series of daily RWU estimates and daily evaluation
@@ -79,6 +624,28 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
         transport (some sort of threshold which could be the noise of the sensed data)
     mintime : float
         minmimal time of a day or night period (in h)
+    method : str
+        regression backend for the night and day linear models. 'numpy' fits all 
+        days at once with closed-form least squares, 'statsmodels' fits each day 
+        with statsmodels OLS and is kept as reference for validation
+    engine : str
+        kernels of the 'numpy' method. 'numba' runs the step detection, the fits and
+        the step control of all days in one compiled loop (requires numba), 'numpy' 
+        uses the vectorized NumPy functions and 'auto' the compiled loop if numba is 
+        installed. Both give identical results.
+    plan : rootwater.rootwater.RWUPlan
+        optional precomputed references of the index of ts (replaces lat, lon and elev),
+        e.g. shared by all sensors of a site
+    dif : numpy.ndarray
+        optional precomputed smoothed soil moisture change of ts (replaces diffx, see 
+        rootwater.rootwater.smoothed_change), e.g. of all sensors of a site at once
+    thresholds : list of tuple
+        optional sets of (slope_diff, maxdiffs, mintime) to evaluate the detected steps
+        with (replaces slope_diff, maxdiffs and mintime, see rootwater.rootwater.sweepRWU),
+        a list of results (one per set) is returned instead (requires method 'numpy')
+    report : bool
+        if True, per-stage timings and per-day failure reasons are collected and
+        returned as rootwater.rootwater.RWUReport together with the results
 
     Returns
     -------
@@ -94,6 +661,11 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
         tin :: start of previous night
         tout :: start of day 
         tix :: start of next night
+        rates, slopes and eval_nse are float64, the control values nullable int16 
+        (pandas.Int16Dtype) and the times datetime64 of the time series index (NaT or 
+        <NA> for days which could not be processed)
+    rep : rootwater.rootwater.RWUReport
+        instrumentation report (only returned as [RWU, rep] if report is True)
     
     
     References
@@ -103,38 +675,46 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
     Submitted to Biogeosciences. DOI to be added
     """
     
-    # use astral to get sunrise/sunset time references as a function of the date    
-    l = LocationInfo()
-    l.latitude = lat
-    l.longitude = lon
-    l.timezone = str(ts.index.tz)
-    l.elevation = elev
+    if method not in ('numpy', 'statsmodels'):
+        raise ValueError("method has to be one of 'numpy' or 'statsmodels'")
+    if engine not in ('auto', 'numba', 'numpy'):
+        raise ValueError("engine has to be one of 'auto', 'numba' or 'numpy'")
+    if (thresholds is not None) & (method != 'numpy'):
+        raise ValueError("thresholds require method 'numpy'")
+    kernel = None if (method != 'numpy') | (engine == 'numpy') else _kernel(engine == 'numba')
+    rep = RWUReport(enabled=report)
+
+    # get unique days in time series, the time step and the astral sunrise/sunset time 
+    # references as a function of the date (the plan is shared by sensors with the same index)
+    if plan is None:
+        plan = RWUPlan(ts.index, lat, lon, elev, report=rep)
+    elif (plan.index is not ts.index) and not plan.index.equals(ts.index):
+        raise ValueError('the plan was made for another time index than the one of ts')
+    ddx = plan.days
+    solar = plan.solar
+    solar_r = dict(zip(solar.index.date, solar.sunrise))
+    solar_s = dict(zip(solar.index.date, solar.sunset))
     
     #sunrise sunset
     def sunr(dd):
         # give date and return time of sunrise
-        sunrise = pd.to_datetime(sun(l,date=dd)['sunrise'])
-        return sunrise.tz_convert(l.timezone)
+        if pd.isnull(solar_r[dd]):
+            raise ValueError('No sunrise at '+str(dd))
+        return solar_r[dd]
         
     def suns(dd):
         # give date and return time of sunset
-        sunset = pd.to_datetime(sun(l,date=dd)['sunset'])
-        return sunset.tz_convert(l.timezone)
-
-    # get unique days in time series
-    ddx = ts.resample('1d').mean().index.date
+        if pd.isnull(solar_s[dd]):
+            raise ValueError('No sunset at '+str(dd))
+        return solar_s[dd]
     
-    # get frequencies of ts
-    freqx = (pd.Series(ts.index[1:]) - pd.Series(ts.index[:-1])).value_counts()
-        
     # get change in soil moisture as smoothed diff
-    dif_ts = pd.Series(spf.gaussian_filter1d(ts.diff(diffx),1))
-    dif_ts.index = ts.index
+    with rep.stage('smoothing'):
+        dif_ts = pd.Series(smoothed_change(ts.values, diffx) if dif is None else dif, index=ts.index)
     
     # create empty dataframe for RWU calculation and evaluation
-    RWU = pd.DataFrame(np.zeros((len(ddx),10))*np.nan)
-    RWU.index = pd.to_datetime(ddx)
-    RWU.columns = ['rwu','rwu_nonight','lm_night','lm_day','step_control','evalx','eval_nse','tin','tout','tix']
+    # (filled day by day or at once and typed in the end, see _rwu_arrays)
+    [rates, codes, known, tpos] = _rwu_arrays(len(ddx))
     
     def startstopRWU(dd):
         # give soilmoisture ts and date, return time of end of RWU
@@ -146,8 +726,10 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
             reflim = np.min([-0.001,tsx.loc[stopRWU:stop2RWU][tsx.loc[stopRWU:stop2RWU]<-0.001].quantile(0.95)])
             startRWU = tsx.loc[stopRWU:].index[tsx.loc[stopRWU:].rolling(3,center=True).mean()<=reflim][0]
             return [stopRWU,startRWU,stop2RWU, 1]
-        except:
+        except Exception as e:
             # in case soil moisture keeps falling without stepping assume 1 hour after sunset/sunrise but return warning flag
+            if rep.enabled:
+                rep.fallbacks[dd] = repr(e)
             try:
                 stopRWU = ts.index[ts.index.get_loc(suns(dd-datetime.timedelta(hours=24))+datetime.timedelta(hours=1), method='nearest')]
                 startRWU = ts.index[ts.index.get_loc(sunr(dd)+datetime.timedelta(hours=2), method='nearest')]
@@ -172,8 +754,11 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
         return [tin,tout,tix]
     
     def dayRWU(dd):
+        import statsmodels.formula.api as smf
+
         # get reference times
-        [tin,tout,tix,evalx] = startstopRWU(dd)
+        with rep.stage('windows'):
+            [tin,tout,tix,evalx] = startstopRWU(dd)
         
         # check for soil moisture differences and min time spans
         if ((tout-tin).seconds<mintime*3600.) | ((tix-tout).seconds<mintime*3600.):
@@ -201,16 +786,16 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
             return [np.nan, np.nan, res.params.x, np.nan, 0, evalx, tin, tout, tix]
         
         # create dummy time series for night time extrapolation
-        dummy = pd.date_range(tin,tix, freq=freqx.index[0])
+        dummy = pd.date_range(tin,tix, freq=plan.step)
         fuse = pd.Series(data = res.params.Intercept+res.params.x*np.arange(len(dummy)), index = dummy)
         
         # control of assumptions of a step
         step_control = 0
-        if res.params.x / ((6.*3600.)/freqx.index[0].seconds) > -0.5/6.: #night slope shall be more than minus 0.5 vol.% per 6h
+        if res.params.x / ((6.*3600.)/plan.step.seconds) > -0.5/6.: #night slope shall be more than minus 0.5 vol.% per 6h
             step_control += 10
-        if res.params.x / ((6.*3600.)/freqx.index[0].seconds) < 1/6.: #night slope shall be less than plus 1 vol.% per 6h
+        if res.params.x / ((6.*3600.)/plan.step.seconds) < 1/6.: #night slope shall be less than plus 1 vol.% per 6h
             step_control += 100
-        if (res2.params.x < 0) & (res2.params.x / ((6.*3600.)/freqx.index[0].seconds) > -0.5/12.): #day slope must be negative but more than minus 0.5 vol.% per 12h
+        if (res2.params.x < 0) & (res2.params.x / ((6.*3600.)/plan.step.seconds) > -0.5/12.): #day slope must be negative but more than minus 0.5 vol.% per 12h
             step_control += 1000
         if res2.params.x < slope_diff*res.params.x: #day slope must be at least 3 times more steep than night (if night was negative)
             step_control += 1
@@ -222,14 +807,18 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
         rwu_nonight = ts.loc[tout]-ts.loc[tix]
         return [rwu, rwu_nonight, res.params.x, res2.params.x, step_control, evalx, tin,tout,tix]
         
-    def dayRWU2(dd,crit_nse=0.5):
+    def dayNSE(dd, window=None):
         # perform comparison to idealised step before evaluation
-        # get reference times
-        [tin,tout,tix,evalx] = startstopRWU(dd)
-        [dtin,dtout,dtix] = idstep_startstop(dd)
+        # get reference times (unless given from the batched detection)
+        if window is None:
+            with rep.stage('windows'):
+                window = startstopRWU(dd)
+        [tin,tout,tix,evalx] = window
+        with rep.stage('idstep'):
+            [dtin,dtout,dtix] = idstep_startstop(dd)
 
         # construct idealised step reference
-        idx = pd.date_range(dtin, dtix, freq=freqx.index[0])
+        idx = pd.date_range(dtin, dtix, freq=plan.step)
         dummy = pd.Series(np.zeros(len(idx))*np.nan,index = idx)
         
         dummy[dtin] = ts.loc[dtin]
@@ -243,22 +832,133 @@ def fRWU(ts,lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdif
         dummyx = dummyx.dropna()
         
         # compare observed soil moisture dynamics with idealised step
+        import hydroeval as he
         evaly = he.nse_c2m(dummyx.obs.values,dummyx.ideal.values)
+        return [tin, tout, tix, evalx, evaly]
+
+    def dayRWU2(dd,crit_nse=0.5):
+        with rep.stage('nse'):
+            [tin, tout, tix, evalx, evaly] = dayNSE(dd)
 
         #if evaly >= crit_nse:
-        [rwu, rwu_nonight, resparamsx, res2paramsx, step_control, evalx, tin2,tout2,tix2] = dayRWU(dd)
+        with rep.stage('fits'):
+            [rwu, rwu_nonight, resparamsx, res2paramsx, step_control, evalx, tin2,tout2,tix2] = dayRWU(dd)
 
         return [rwu, rwu_nonight, resparamsx, res2paramsx, step_control, evalx, evaly, tin,tout,tix]
-        
-    for dd in ddx[:-1]:
+
+    def failed(dd, reason):
+        print(str(dd)+' could not be processed.')
+        if rep.enabled:
+            rep.failures[dd] = reason
+
+    def result():
+        RWU = _rwu_frame(pd.to_datetime(ddx), ts.index, rates, codes, known, tpos)
+        return [RWU, rep] if report else RWU
+
+    if method == 'statsmodels':
+        for i, dd in enumerate(ddx[:-1]):
+            t0 = time.perf_counter()
+            try:
+                row = dayRWU2(dd)
+                rates[i] = row[:4] + row[6:7]
+                codes[i] = row[4:6]
+                known[i] = True
+                tpos[i] = ts.index.searchsorted(row[7:])
+            except Exception as e:
+                failed(dd, repr(e))
+            if rep.enabled:
+                rep.days[dd] = time.perf_counter() - t0
+        return result()
+
+    # detect the step windows of all days at once on integer time stamps
+    # (the compiled kernel also fits and scores all days in the same loop)
+    y = ts.values.astype(float)
+    T = plan.T
+    step = plan.step.as_unit('ns').value
+    with rep.stage('windows'):
+        if kernel is None:
+            [wtin, wtout, wtix, wevalx, wreason, wok] = _startstop_windows(dif_ts.values, T, 
+                plan.sunset_prev, plan.sunrise, plan.sunset, plan.bounds)
+        else:
+            [wtin, wtout, wtix, wreason, wok, wfits, wcontrol, wgrid] = kernel(
+                np.ascontiguousarray(dif_ts.values, dtype=float), y, T, plan.sunset_prev, plan.sunrise, 
+                plan.sunset, step, float(slope_diff), float(maxdiffs), float(mintime))
+            wevalx = (wreason == 0).astype(int)
+
+    # evaluate the step shape of all days at once against the idealised step
+    # (days off the regular grid are left to the per-day reference in dayNSE)
+    h = 3600*10**9
+    wid = plan.idstep
+    with rep.stage('nse'):
+        if plan.unique and wok.any():
+            [wnse, wfast] = _step_nse(y, T, step, wid[0], wid[1], wid[2], T[wtin] - h//2, T[wtix] + h//2)
+            wfast &= wok
+        else:
+            wfast = np.zeros(len(wok), dtype=bool)
+
+    ix = []
+    nse = []
+    for i, dd in enumerate(ddx[:-1]):
+        t0 = time.perf_counter()
+        if rep.enabled and wok[i] and wreason[i] > 0:
+            rep.fallbacks[dd] = _FALLBACKS[wreason[i]]
+        window = [ts.index[wtin[i]], ts.index[wtout[i]], ts.index[wtix[i]], wevalx[i]]
         try:
-            RWU.loc[dd] = dayRWU2(dd)
-        except:
-            print(str(dd)+' could not be processed.')
+            if not wok[i]:
+                raise ValueError('No solar references or data at '+str(dd))
+            if wfast[i]:
+                nse.append(wnse[i])
+            else:
+                with rep.stage('nse'):
+                    nse.append(dayNSE(dd, window)[4])
+            ix.append(i)
+        except Exception as e:
+            failed(dd, repr(e))
+        if rep.enabled:
+            rep.days[dd] = time.perf_counter() - t0
+    ix = np.array(ix, dtype=int)
+    nse = np.array(nse, dtype=float)
+    # first positions of the reference times (as located by time stamp in dayRWU)
+    [pin, pout, pix] = [np.searchsorted(T, T[p[ix]]) for p in [wtin, wtout, wtix]]
+    shared = (kernel is None) | (thresholds is not None)
+    if shared:
+        with rep.stage('fits'):
+            lines = _rwu_lines(y, T, pin, pout, pix)
     
-    return RWU
+    def score(slope_diff, maxdiffs, mintime):
+        # results of the processed days for a set of thresholds
+        with rep.stage('fits'):
+            if shared:
+                [rwu, rwu_nonight, lm_n, lm_d, step_control, ongrid] = _rwu_score(lines, y, T, step, 
+                    pin, pout, pix, _exceeds(dif_ts.values, pin, pix, maxdiffs), slope_diff, mintime)
+            else:
+                [rwu, rwu_nonight, lm_n, lm_d] = wfits[ix].T
+                step_control = wcontrol[ix]
+                ongrid = wgrid[ix]
+        for i in np.where(~ongrid)[0]:
+            failed(ddx[ix[i]], 'end of day (tix) is not on the time step grid of the night (tin)')
+        
+        [rates, codes, known, tpos] = _rwu_arrays(len(ddx))
+        jx = ix[ongrid]
+        for j, val in enumerate([rwu, rwu_nonight, lm_n, lm_d, nse]):
+            rates[jx, j] = val[ongrid]
+        codes[jx, 0] = step_control[ongrid]
+        codes[jx, 1] = wevalx[jx]
+        known[jx] = True
+        tpos[jx] = np.column_stack([wtin[jx], wtout[jx], wtix[jx]])
+        return _rwu_frame(pd.to_datetime(ddx), ts.index, rates, codes, known, tpos)
 
-def dfRWUc(dummyd,tz='Etc/GMT-1',safeRWU=True,lat=49.70764, lon=5.897638, elev=200., savgol=False):
+    if thresholds is None:
+        RWU = score(slope_diff, maxdiffs, mintime)
+    else:
+        RWU = [score(*t) for t in thresholds]
+    return [RWU, rep] if report else RWU
+
+def _fRWU_dif(ts, dif, **kwargs):
+    # fRWU of a column with its precomputed smoothed change (mapped by dfRWUc and sweepRWU)
+    return fRWU(ts, dif=dif, **kwargs)
+
+def dfRWUc(dummyd,tz='Etc/GMT-1',safeRWU=True,lat=49.70764, lon=5.897638, elev=200., savgol=False, n_jobs=1, executor=None, report=False):
     r"""Wrapper to quickly apply rootwater.rootwater.fRWU to a dataframe with soil moisture values.
 
     Returns three dataframes with RWU, RWU_without nocturnal correction, step shape NSE
@@ -280,6 +980,17 @@ def dfRWUc(dummyd,tz='Etc/GMT-1',safeRWU=True,lat=49.70764, lon=5.897638, elev=2
         longitude of location (degree)
     elev : float
         elevation at location (m above msl)
+    savgol : bool
+        apply a Savitzky-Golay filter to the soil moisture data before processing
+        (to every run of values between gaps of at least 15 time steps)
+    n_jobs : int
+        number of worker processes to distribute the columns to 
+        (1 runs sequentially, -1 uses all cores)
+    executor : concurrent.futures.Executor
+        optional executor to map the columns with (overrides n_jobs)
+    report : bool
+        if True, the rootwater.rootwater.RWUReport of every column is returned as 
+        fourth element (dict of column name and report)
     
     Returns
     -------
@@ -301,40 +1012,395 @@ def dfRWUc(dummyd,tz='Etc/GMT-1',safeRWU=True,lat=49.70764, lon=5.897638, elev=2
     dummyd = dummyd.tz_localize(tz)
     dummyc = dummyd.columns
 
+    # preprocessing of all columns at once (time steps x sensors)
+    SM = dummyd.to_numpy(dtype=float)
     if savgol:
         #apply Savitzky-Golay filter to data to reduce noise
-        for i in dummyc:
-            dummyd[i] = savgol_filter(dummyd[i],15,1)
-    
-    #first column
-    dummz = fRWU(dummyd[dummyc[0]],lat=lat, lon=lon, elev=elev)
-    if safeRWU:
-        dummz.loc[dummz.step_control<11111,'rwu'] = np.nan #refuse values based on too much night increase and no day decrease
-        dummz.loc[dummz.rwu<0.,'rwu'] = np.nan #refuse values less than zero
-    dummx = dummz.rwu
+        SM = _savgol(SM)
+    dif = smoothed_change(SM)
     
+    # every column is an independent fRWU call on the references of the shared index
+    plan = RWUPlan(dummyd.index, lat, lon, elev)
+    fRWUx = functools.partial(_fRWU_dif, plan=plan, report=report)
+    columns = [pd.Series(SM[:, i], index=dummyd.index, name=c) for i, c in enumerate(dummyc)]
+    difs = [dif[:, i] for i in range(len(dummyc))]
+    if executor is not None:
+        res = list(executor.map(fRWUx, columns, difs))
+    elif n_jobs != 1:
+        n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+        with ProcessPoolExecutor(max_workers=max(1, min(n_jobs, len(dummyc)))) as ex:
+            res = list(ex.map(fRWUx, columns, difs))
+    else:
+        res = [fRWUx(x, d) for x, d in zip(columns, difs)]
+    if report:
+        reps = dict(zip(dummyc, [d[1] for d in res]))
+        res = [d[0] for d in res]
+
+    # stack all columns at once
+    rwu = np.column_stack([d.rwu.values.astype(float) for d in res])
+    rwu_nonight = np.column_stack([d.rwu_nonight.values.astype(float) for d in res])
+    nse = np.column_stack([d.eval_nse.values.astype(float) for d in res])
     if safeRWU:
-        dummz.loc[dummz.step_control<11111,'rwu_nonight'] = np.nan #refuse values based on too much night increase and no day decrease
-        dummz.loc[dummz.rwu_nonight<0.,'rwu_nonight'] = np.nan #refuse values less than zero
-    dummy = dummz.rwu_nonight
-    dummc = dummz.eval_nse
-    
-    #process further columns
-    for i in dummyc[1:]:
-        dummz = fRWU(dummyd[i])
-        if safeRWU:
-            dummz.loc[dummz.step_control<11111,'rwu'] = np.nan #refuse values based on too much night increase and no day decrease
-            dummz.loc[dummz.rwu<0.,'rwu'] = np.nan #refuse values less than zero
-        dummx = pd.concat([dummx,dummz.rwu],axis=1)
-        
-        if safeRWU:
-            dummz.loc[dummz.step_control<11111,'rwu_nonight'] = np.nan #refuse values based on too much night increase and no day decrease
-            dummz.loc[dummz.rwu_nonight<0.,'rwu_nonight'] = np.nan #refuse values less than zero
-        dummy = pd.concat([dummy,dummz.rwu_nonight], axis=1)
+        #refuse values based on too much night increase and no day decrease and values less than zero
+        refuse = np.column_stack([(d.step_control<11111).fillna(False).to_numpy(dtype=bool) for d in res])
+        with np.errstate(invalid='ignore'):
+            rwu[refuse | (rwu<0.)] = np.nan
+            rwu_nonight[refuse | (rwu_nonight<0.)] = np.nan
+
+    dummx = pd.DataFrame(rwu, index=res[0].index, columns=dummyc)
+    dummy = pd.DataFrame(rwu_nonight, index=res[0].index, columns=dummyc)
+    dummc = pd.DataFrame(nse, index=res[0].index, columns=dummyc)
+    if report:
+        return [dummx, dummy, dummc, reps]
+    return [dummx, dummy, dummc]
+
+def sweepRWU(dummyd, tz='Etc/GMT-1', lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdiffs=0.25, mintime=3.5, n_jobs=1, executor=None):
+    r"""Apply rootwater.rootwater.fRWU to a dataframe with soil moisture values for a grid of parameters
+
+    Every intermediate result is computed once for the parameters it depends on: the
+    days and solar references once (rootwater.rootwater.RWUPlan), the smoothed soil 
+    moisture change of all columns once per diffx, the step detection, step shape 
+    evaluation and linear models once per diffx and column, and only the checks and 
+    the step control for every set of slope_diff, maxdiffs and mintime.
+
+    Parameters
+    ----------
+    dummyd : pandas.DataFrame with datetime index
+        input data frame of columns of soil moisture (assumes vol.%) 
+    tz : str
+        time zone which is required for the astral solar reference and follows 
+        its nomenclature
+    lat : float 
+        latitude of location (degree)
+    lon : float 
+        longitude of location (degree)
+    elev : float
+        elevation at location (m above msl)
+    diffx, slope_diff, maxdiffs, mintime : float or list of float
+        values of the parameters of fRWU, all combinations are evaluated
+    n_jobs : int
+        number of worker processes to distribute the columns to 
+        (1 runs sequentially, -1 uses all cores)
+    executor : concurrent.futures.Executor
+        optional executor to map the columns with (overrides n_jobs)
+
+    Returns
+    -------
+    cube : pandas.DataFrame
+        fRWU results (without the quality controls of dfRWUc) indexed by diffx, 
+        slope_diff, maxdiffs, mintime, time and id (column of dummyd)
+
+    Examples
+    --------
+    >>> cube = sweepRWU(SM, diffx=[2, 3, 4], maxdiffs=[0.1, 0.25, 0.5], mintime=[3., 3.5, 4.])
+    >>> cube.rwu.groupby(level=['diffx', 'maxdiffs']).mean()
+    """
+    grid = lambda x: [x] if np.isscalar(x) else list(x)
+    thresholds = list(itertools.product(grid(slope_diff), grid(maxdiffs), grid(mintime)))
+    dummyd = dummyd.tz_localize(tz)
+    dummyc = dummyd.columns
+    SM = dummyd.to_numpy(dtype=float)
+    plan = RWUPlan(dummyd.index, lat, lon, elev)
+    columns = [pd.Series(SM[:, i], index=dummyd.index, name=c) for i, c in enumerate(dummyc)]
+
+    parts = {}
+    ex = executor
+    if (executor is None) & (n_jobs != 1):
+        n_jobs = os.cpu_count() if n_jobs in (None, -1) else n_jobs
+        ex = ProcessPoolExecutor(max_workers=max(1, min(n_jobs, len(dummyc))))
+    try:
+        for d in grid(diffx):
+            dif = smoothed_change(SM, d)
+            fRWUx = functools.partial(_fRWU_dif, plan=plan, thresholds=thresholds)
+            difs = [dif[:, i] for i in range(len(dummyc))]
+            res = ex.map(fRWUx, columns, difs) if ex is not None else map(fRWUx, columns, difs)
+            for c, r in zip(dummyc, res):
+                for t, x in zip(thresholds, r):
+                    parts[(d,) + t + (c,)] = x
+    finally:
+        if (ex is not None) & (executor is None):
+            ex.shutdown()
+
+    cube = pd.concat(parts, names=['diffx', 'slope_diff', 'maxdiffs', 'mintime', 'id', 'time'])
+    return cube.reorder_levels(['diffx', 'slope_diff', 'maxdiffs', 'mintime', 'time', 'id']).sort_index()
+
+def _ensemble(ts, plan, rng, n, noise, shift, q, **kwargs):
+    # quantiles of the ensemble of one sensor (see ensembleRWU)
+    res = fRWU(ts, plan=plan, **kwargs)
+    y = ts.values.astype(float)
+    T = plan.T
+    step = plan.step.as_unit('ns').value
+    h = 3600*10**9
+    days = np.where(res.rwu.notna().to_numpy())[0]
+    [pin, pout, pix] = [np.searchsorted(T, pd.DatetimeIndex(res[c].iloc[days]).as_unit('ns').asi8) 
+                        for c in ['tin', 'tout', 'tix']]
+
+    # night models of all shifts of tin and tout per day (with their moments for the noise)
+    ks = np.arange(-shift, shift + 1)
+    clip = lambda p: np.clip(p, 0, len(T) - 1)
+    start = clip(pin[:, None, None] + ks[:, None]).repeat(len(ks), axis=2).reshape(len(days), -1)
+    tout = clip(pout[:, None, None] + ks[None, :]).repeat(len(ks), axis=1).reshape(len(days), -1)
+    stop = np.searchsorted(T, T[tout] - h, side='right')
+    lm_n, ic_n, n_n = [x.reshape(len(days), -1) for x in _linfit_windows(y, start.ravel(), stop.ravel())]
+    Y = _gather(y, start.ravel(), stop.ravel())[0]
+    valid = np.isfinite(Y)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        xm = (np.where(valid, np.arange(Y.shape[1]), 0.).sum(axis=1) / valid.sum(axis=1)).reshape(len(days), -1)
+        sxx = (np.where(valid, np.arange(Y.shape[1]) - xm.reshape(-1, 1), 0.)**2).sum(axis=1).reshape(len(days), -1)
+
+    # members: shifted time references and reading noise
+    k = rng.integers(0, len(ks), size=(3, len(days), n))
+    combo = k[0]*len(ks) + k[1]
+    rin = clip(pin[:, None] + ks[k[0]])
+    rout = clip(pout[:, None] + ks[k[1]])
+    rix = clip(pix[:, None] + ks[k[2]])
+    take = lambda x: np.take_along_axis(x, combo, axis=1)
+    fsteps = (T[rix] - T[rin]) / step
+    with np.errstate(invalid='ignore', divide='ignore'):
+        # the night extrapolation of noisy readings is normal around the one of the series
+        sd = noise*np.sqrt(1./take(n_n) + (fsteps - take(xm))**2/take(sxx))
+        sd[take(n_n) < 2] = np.nan
+        z = rng.standard_normal((3, len(days), n))
+        fuse = take(ic_n) + take(lm_n)*fsteps + sd*z[0]
+        yix = y[rix] + noise*z[1]
+        rwu = fuse - yix
+        rwu_nonight = y[rout] + noise*z[2] - yix
+
+    out = pd.DataFrame(np.nan, index=res.index, columns=pd.MultiIndex.from_product([['rwu', 'rwu_nonight'], q]))
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', RuntimeWarning)
+        for name, R in [('rwu', rwu), ('rwu_nonight', rwu_nonight)]:
+            if len(days):
+                out.iloc[days, out.columns.get_loc(name)] = np.nanquantile(R, q, axis=1).T
+    return out
+
+def ensembleRWU(ts, n=1000, noise=0.1, shift=1, q=(0.05, 0.5, 0.95), seed=None, **kwargs):
+    r"""Monte Carlo uncertainty of the daily root water uptake estimates of rootwater.rootwater.fRWU
+
+    Every member of the ensemble perturbs the soil moisture readings with independent 
+    gaussian noise and shifts the detected start of the night, start of the day and end 
+    of the day (tin, tout, tix) by up to shift time steps. The members are evaluated as 
+    arrays (days x members) without further fRWU calls: the night models are fitted once
+    for every shift of the night window, and since the linear models are linear in the 
+    readings, the extrapolation of noisy readings is drawn from its exact normal 
+    distribution around them. Days without a point estimate of fRWU are not evaluated.
+
+    Parameters
+    ----------
+    ts : pandas.Series or pandas.DataFrame with time zone aware datetime index
+        soil moisture of one sensor or of several sensors with the same index (assumes vol.%) 
+    n : int
+        number of members
+    noise : float
+        standard deviation of the reading noise (vol.%)
+    shift : int
+        maximum shift of the time references (time steps)
+    q : list of float
+        quantiles of the ensemble
+    seed : int
+        seed of the random number generator
+    **kwargs :
+        further parameters passed to rootwater.rootwater.fRWU (e.g. lat, lon, elev, diffx)
+
+    Returns
+    -------
+    quantiles : pandas.DataFrame
+        quantiles of rwu and rwu_nonight (columns of variable and quantile) per day, or
+        per day and sensor (index time and id) for a data frame of sensors
+
+    Examples
+    --------
+    >>> ens = ensembleRWU(SM['Sand_SM_10'], n=1000, noise=0.1, seed=1)
+    >>> ens['rwu'][0.95] - ens['rwu'][0.05]
+    """
+    q = list(np.atleast_1d(q))
+    rng = np.random.default_rng(seed)
+    site = dict((k, kwargs.pop(k)) for k in ['lat', 'lon', 'elev'] if k in kwargs)
+    plan = kwargs.pop('plan', None)
+    if plan is None:
+        plan = RWUPlan(ts.index, **site)
+    if isinstance(ts, pd.Series):
+        return _ensemble(ts, plan, rng, n, noise, shift, q, **kwargs)
     
-        dummc = pd.concat([dummc,dummz.eval_nse],axis=1)
+    # sensors of a profile share the plan and their smoothed change is computed at once
+    dif = smoothed_change(ts, kwargs.pop('diffx', 3)) if 'dif' not in kwargs else kwargs.pop('dif')
+    res = [_ensemble(ts[c], plan, rng, n, noise, shift, q, dif=dif[:, i], **kwargs) for i, c in enumerate(ts.columns)]
+    return pd.concat(res, keys=ts.columns, names=['id', 'time']).swaplevel().sort_index()
+
+class RWUStream(object):
+    r"""Incremental root water uptake estimation for appended soil moisture records
+
+    Keeps the trailing part of a soil moisture time series which is required as 
+    context for the smoothed soil moisture change and the lookback to the previous 
+    night. Every update with newly arrived records returns the rootwater.rootwater.fRWU 
+    rows of the days which have been completed by the update. The results are the 
+    same as of fRWU applied to the full series (assuming a regular time step).
+
+    Parameters
+    ----------
+    lat, lon, elev, diffx, slope_diff, maxdiffs, mintime, method :
+        parameters passed to rootwater.rootwater.fRWU
+
+    Examples
+    --------
+    >>> stream = RWUStream(lat=49.70764, lon=5.897638, elev=200.)
+    >>> for chunk in chunks:
+    ...     new_days = stream.update(chunk)
+    >>> last_days = stream.flush()
+    """
+
+    # reach of the gaussian smoothing of the soil moisture change (in time steps)
+    pad = 4
+
+    def __init__(self, lat=49.70764, lon=5.897638, elev=200., diffx=3, slope_diff=3, maxdiffs=0.25, mintime=3.5, method='numpy'):
+        self.kwargs = dict(lat=lat, lon=lon, elev=elev, diffx=diffx, slope_diff=slope_diff, 
+                           maxdiffs=maxdiffs, mintime=mintime, method=method)
+        self.buffer = None
+        self.next_day = None
+
+    def update(self, ts):
+        r"""Append soil moisture records and return RWU of newly completed days
+
+        Parameters
+        ----------
+        ts : pandas.Series with time zone aware datetime index
+            new records of one soil moisture sensor (records which are not later 
+            than the last record seen before are ignored)
+
+        Returns
+        -------
+        RWU : pandas.DataFrame
+            fRWU results for the days which have been completed by the new records
+        """
+        ts = ts.sort_index()
+        if self.buffer is None:
+            self.buffer = ts
+        else:
+            self.buffer = pd.concat([self.buffer, ts.loc[ts.index > self.buffer.index[-1]]])
+        if len(self.buffer) < 2:
+            return self._process([])
+
+        # a day is complete when the next day has begun and the smoothed change covers 
+        # its evaluation window (until 2 h after sunset)
+        days = self._days()
+        step = self._step()
+        solar = solar_table(self.kwargs['lat'], self.kwargs['lon'], self.kwargs['elev'], str(self.buffer.index.tz),
+                            days[0], days[-1])
+        horizon = solar.sunset.loc[days] + datetime.timedelta(hours=2) + self.pad*step
+        midnight = pd.Series((days + datetime.timedelta(days=1)).tz_localize(self.buffer.index.tz), index=days)
+        horizon = horizon.where(horizon > midnight, midnight)
+
+        return self._process(days[(horizon <= self.buffer.index[-1]).values])
+
+    def flush(self):
+        r"""Return RWU of all remaining days like at the end of a full series
+
+        Returns
+        -------
+        RWU : pandas.DataFrame
+            fRWU results for all days which have not been returned yet (except the last
+            day of the series, which fRWU does not process either)
+        """
+        if self.buffer is None:
+            return self._process([])
+        return self._process(self._days()[:-1])
+
+    def _days(self):
+        # days of the buffer which have not been returned yet
+        days = pd.DatetimeIndex(np.unique(self.buffer.index.tz_localize(None).normalize()))
+        if self.next_day is not None:
+            days = days[days >= self.next_day]
+        return days
+
+    def _step(self):
+        # most common time step as in fRWU
+        return (pd.Series(self.buffer.index[1:]) - pd.Series(self.buffer.index[:-1])).value_counts().index[0]
+
+    def _process(self, days):
+        if len(days) == 0:
+            tindex = pd.DatetimeIndex([]) if self.buffer is None else self.buffer.index
+            return _rwu_frame(pd.DatetimeIndex([]), tindex, *_rwu_arrays(0))
+
+        RWU = fRWU(self.buffer, **self.kwargs).loc[days]
+        self.next_day = days[-1] + datetime.timedelta(days=1)
+
+        # keep the context of the next day: its previous night starts 5 h before the last
+        # sunset and the smoothed change reaches back diffx and the smoothing time steps
+        last = days[-1]
+        sunset = solar_table(self.kwargs['lat'], self.kwargs['lon'], self.kwargs['elev'], str(self.buffer.index.tz),
+                             last, last).sunset.iloc[0]
+        start = last.tz_localize(self.buffer.index.tz)
+        if pd.isnull(sunset):
+            start = start - datetime.timedelta(days=1)
+        else:
+            start = min(start, sunset - datetime.timedelta(hours=5))
+        start = start - (self.kwargs['diffx'] + self.pad + 1)*self._step()
+        self.buffer = self.buffer.loc[start:]
+        return RWU
+
+def csvRWU(fname, out, tz='Etc/GMT-1', columns=None, chunksize=10000, format='npz', lat=49.70764, lon=5.897638, elev=200., **kwargs):
+    r"""Apply rootwater.rootwater.fRWU to a soil moisture archive too large for memory
+
+    Reads a csv file of soil moisture columns (like the input of rootwater.rootwater.dfRWUc) 
+    in chunks of rows, feeds every column to a rootwater.rootwater.RWUStream (which keeps 
+    the overlap of days across chunks) and writes the results of completed days of every 
+    chunk as a part file with rootwater.store.write_results. Memory scales with the 
+    chunk size instead of the archive length.
+
+    Parameters
+    ----------
+    fname : str
+        csv file with a datetime index in the first column and soil moisture columns 
+        (assumes vol.%)
+    out : str
+        directory for the part files (created if needed), which can be read at once with 
+        rootwater.store.read_results
+    tz : str
+        time zone of the time stamps which is required for the astral solar reference
+    columns : list of str
+        optional selection of columns to process (default all)
+    chunksize : int
+        number of rows read at once
+    format : str
+        format of the part files ('npz', 'parquet' or 'feather')
+    lat : float 
+        latitude of location (degree)
+    lon : float 
+        longitude of location (degree)
+    elev : float
+        elevation at location (m above msl)
+    **kwargs :
+        further parameters passed to rootwater.rootwater.fRWU (diffx, slope_diff, 
+        maxdiffs, mintime, method)
+
+    Returns
+    -------
+    parts : list of str
+        written part files with the fRWU results of all columns (index time and id)
+
+    Notes
+    -----
+    In contrast to dfRWUc, no quality controls (safeRWU) are applied. The step_control 
+    codes are stored with the results instead.
+    """
+    from . import store
+
+    index = pd.read_csv(fname, nrows=0).columns[0]
+    if columns is None:
+        columns = list(pd.read_csv(fname, index_col=0, nrows=0).columns)
+    if not os.path.isdir(out):
+        os.makedirs(out)
+    streams = dict((c, RWUStream(lat=lat, lon=lon, elev=elev, **kwargs)) for c in columns)
+
+    def write(results):
+        results = pd.concat(results, keys=columns, names=['id', 'time']).swaplevel().sort_index()
+        if len(results) == 0:
+            return
+        parts.append(store.write_results(results, os.path.join(out, 'part_%05d.%s' % (len(parts), format))))
 
-    dummx.columns = dummyd.columns
-    dummy.columns = dummyd.columns
-    dummc.columns = dummyd.columns
-    return [dummx, dummy, dummc]
\ No newline at end of file
+    parts = []
+    for chunk in pd.read_csv(fname, index_col=0, usecols=[index] + list(columns), chunksize=chunksize):
+        chunk.index = pd.to_datetime(chunk.index).tz_localize(tz)
+        write([streams[c].update(chunk[c]) for c in columns])
+    write([streams[c].flush() for c in columns])
+    return parts
@@ -28,9 +28,11 @@ trees to entire forest stands, Trees, 18(5), 529–546, doi:10.1007/s00468-004-0
 import json
 import sys
 import os
+import collections
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 import pandas as pd
-from scipy.optimize import minimize_scalar
 
 sys.path.append(os.path.dirname(__file__))
 from gebauer_params import gp
@@ -39,6 +41,27 @@ from gebauer_params import gp
 #    four Weibull parameters a,b,c,d
 
 
+def _check_trees(tree):
+    # sapwood geometry needs the bark and sapwood allometry (roessler, gebauer), which is
+    # only given for beech and oak, and the Weibull parameters of gp (no oak)
+    supported = set(gp.keys()) & {'beech', 'oak'}
+    unsupported = set(np.unique(np.asarray(tree).astype(str))) - supported
+    if len(unsupported) > 0:
+        raise ValueError('Tree %s is not supported (sapwood allometry and Weibull parameters are only given for %s)' 
+                         % (', '.join(sorted(unsupported)), ', '.join(sorted(supported))))
+
+
+def _match_profile(profile, r, tree, perc=None, n_points=None):
+    # a precalculated sapwood profile has to be the one of the tree it is used for
+    given = dict(r=r, tree=tree, perc=perc, n_points=n_points)
+    of = dict(r=profile.r, tree=profile.tree, perc=profile.perc, n_points=len(profile.depth))
+    bad = [k for k in given if (given[k] is not None) and np.any(np.asarray(given[k]) != of[k])]
+    if len(bad) > 0:
+        raise ValueError('The sapwood profile does not match %s' % 
+                         ', '.join('%s=%s (profile %s)' % (k, given[k], of[k]) for k in bad))
+    return profile
+
+
 def roessler(r, tree='beech'):
     r"""Estimate bark thickness
 
@@ -75,7 +98,7 @@ def roessler(r, tree='beech'):
     return db / 10
 
 
-def gebauer(r, tree='beech'):
+def gebauer(r, tree='beech', profile=None):
     r"""Sap-wood thickness
 
     Calculates sap-wood thickness as published by Gebauer et al. (2008)
@@ -87,6 +110,8 @@ def gebauer(r, tree='beech'):
     tree : str
         Tree name, for which to calculate bark and sapwood thickness.
         Can be one of ['beech', 'oak']
+    profile : SapwoodProfile
+        precalculated sapwood profile of the tree (has to match r and tree)
 
     Returns
     -------
@@ -104,6 +129,9 @@ def gebauer(r, tree='beech'):
     broad-leaved tree species, Tree Physiol., 28, 1821–1830, 2008.
 
     """
+    if profile is not None:
+        return _match_profile(profile, r, tree).sw
+    
     r = r - roessler(r, tree=tree) / 2.
     
     if tree=='beech':
@@ -162,11 +190,13 @@ def get_default_gp():
     return params
 
 
-def gebauer_rel(r, tree='beech', n_points=50):
+def gebauer_rel(r, tree='beech', n_points=50, profile=None):
     r"""relative flux density
 
     Calculates relative flux density as a function 
-    of depth on sapwood for n_points. 
+    of depth on sapwood for n_points. The depth grid follows the sapwood 
+    thickness of beech for all trees (see rootwater.sapflow.sapwood_profile
+    for the grid of the tree's own sapwood thickness).
 
     Parameters
     ----------
@@ -178,6 +208,8 @@ def gebauer_rel(r, tree='beech', n_points=50):
     n_points : int
         Number of points for solving Weibull. 
         This is the resolution over depth.
+    profile : SapwoodProfile
+        precalculated sapwood profile of the tree (has to match r, tree and n_points)
 
     Returns
     -------
@@ -191,13 +223,15 @@ def gebauer_rel(r, tree='beech', n_points=50):
     broad-leaved tree species, Tree Physiol., 28, 1821–1830, 2008.
 
     """
-    
-    x=np.arange(n_points)/ n_points *gebauer(r)
+    if profile is not None:
+        return _match_profile(profile, r, tree, n_points=n_points).rel
     
     p = gp.get(tree)
 
     if p is None:
         raise ValueError('Tree %s is unknown' % tree)
+    
+    x=np.arange(n_points)/ n_points *gebauer(r)
     return gebauer_weibull(x, p['a'], p['b'], p['c'], p['d'])
 
 
@@ -260,11 +294,12 @@ def galvac(r):
     return -1.*(np.sqrt((np.pi*r**2 - As)/np.pi)-r)
 
 
-def gebauer_act(r,perc=0.95,tree='beech'):
+def gebauer_act(r,perc=0.95,tree='beech',n_points=50,profile=None):
     r"""Active sapwood area based on percentile of Weibull distribution
 
     Calculates the "zero" sap velocity limit as given percentile of relative 
-    flux velocity distribution as a Weibull function after Gebauer et al. (2008)
+    flux velocity distribution as a Weibull function after Gebauer et al. (2008).
+    Arrays of trees are evaluated at once on a (trees x n_points) grid.
 
     Parameters
     ----------
@@ -272,9 +307,14 @@ def gebauer_act(r,perc=0.95,tree='beech'):
         tree radius at breast height (in cm)
     perc : float
         percentile to define the "zero" sap velocity limit
-    tree : str
-        Tree name, for which to calculate Weibull function.
-        Tree name has to be in gp.keys()
+    tree : str or numpy.ndarray of str
+        Tree name (or one name per tree), for which to calculate sapwood thickness and
+        Weibull function. Both are only given for 'beech' so far (ValueError otherwise)
+    n_points : int
+        Number of points for solving Weibull. 
+        This is the resolution over depth.
+    profile : SapwoodProfile
+        precalculated sapwood profile of the tree (has to match r, perc, tree and n_points)
     
     Returns
     -------
@@ -288,29 +328,114 @@ def gebauer_act(r,perc=0.95,tree='beech'):
     broad-leaved tree species, Tree Physiol., 28, 1821–1830, 2008.
 
     """
-    if type(r)==float:
-        return np.where(np.cumsum(gebauer_rel(r,tree))/sum(gebauer_rel(r,tree))>perc)[0][0]/50.*gebauer(r,tree)
-    else:
-        act_sap = r*np.nan
-        for i in np.arange(len(r))[1:]:
-            act_sap[i] = np.where(np.cumsum(gebauer_rel(r[i],tree))/sum(gebauer_rel(r[i],tree))>perc)[0][0]/50.*gebauer(r[i],tree)
-        return act_sap
+    if profile is not None:
+        return _match_profile(profile, r, tree, perc, n_points).act
+    
+    _check_trees(tree)
+    if (np.ndim(r) == 0) & (np.ndim(tree) == 0):
+        return sapwood_profile(float(r),str(tree),perc,n_points).act
+    
+    r, tree = np.broadcast_arrays(np.asarray(r, dtype=float), np.asarray(tree))
+    
+    # Weibull parameters per tree
+    p = {k: np.array([gp[t][k] for t in tree.ravel()]).reshape(tree.shape + (1,)) for k in 'abcd'}
+    
+    # sapwood thickness and depth grid per tree
+    sw = np.empty(r.shape)
+    for t in np.unique(tree):
+        sw[tree == t] = gebauer(r[tree == t], t)
+    x = np.arange(n_points)/n_points*sw[..., None]
+    
+    rel = gebauer_weibull(x, p['a'], p['b'], p['c'], p['d'])
+    cdf = np.cumsum(rel, axis=-1)/np.sum(rel, axis=-1, keepdims=True)
+    above = cdf > perc
+    act_sap = np.argmax(above, axis=-1)/n_points*sw
+    act_sap[~above.any(axis=-1)] = np.nan
+    return act_sap
+
+
+SapwoodProfile = collections.namedtuple('SapwoodProfile', ['r', 'tree', 'perc', 'sw', 'depth', 'rel', 'cdf', 'act', 'ring_area'])
+SapwoodProfile.__doc__ = r"""Sapwood geometry and relative flux density of a tree
+
+    r : tree radius at breast height (in cm)
+    tree : tree name
+    perc : percentile defining the "zero" sap velocity limit
+    sw : sapwood thickness (in cm)
+    depth : depth of the sampling points in the sapwood (in cm)
+    rel : relative flux density at the sampling points
+    cdf : cumulative distribution of the relative flux density
+    act : depth of the active sapwood (in cm)
+    ring_area : area of the ring around each sampling point (in cm2)
+    """
+
+
+@functools.lru_cache(maxsize=4096)
+def sapwood_profile(r, tree='beech', perc=0.95, n_points=50):
+    r"""Sapwood profile of a tree
 
+    Calculates the depth grid, the relative flux density after Gebauer et al. (2008),
+    its cumulative distribution, the active sapwood depth and the areas of the rings 
+    around the grid points of a tree once. Profiles are kept in a bounded cache
+    (least recently used profiles are dropped), so every tree of a stand inventory 
+    is only calculated once. The profile can be passed on to gebauer, gebauer_rel, 
+    gebauer_act, sap_volume and sap_calc instead of calculating it again.
 
-def sap_volume(r,s1,s2,vout=False,perc=0.95,tree='beech'):
+    Parameters
+    ----------
+    r : float
+        tree radius at breast height (in cm)
+    tree : str
+        Tree name, for which to calculate bark thickness and Weibull function.
+        Only 'beech' has both so far (ValueError otherwise)
+    perc : float
+        percentile to define the "zero" sap velocity limit
+    n_points : int
+        Number of points for solving Weibull. 
+        This is the resolution over depth.
+
+    Returns
+    -------
+    profile : SapwoodProfile
+        named tuple with r, tree, perc, sw, depth, rel, cdf, act and ring_area 
+        (arrays are read-only)
+
+    References
+    ----------
+    Gebauer, T., Horna, V., and Leuschner, C.: Variability in radial sap flux
+    density patterns and sapwood area among seven co-occurring temperate 
+    broad-leaved tree species, Tree Physiol., 28, 1821–1830, 2008.
+
+    """
+    _check_trees(tree)
+    sw = gebauer(r, tree)
+    depth = np.arange(n_points)/n_points*sw
+    p = gp[tree]
+    rel = gebauer_weibull(depth, p['a'], p['b'], p['c'], p['d'])
+    cdf = np.cumsum(rel)/np.sum(rel)
+    act = np.where(cdf > perc)[0][0]/n_points*sw
+    ring_area = A_circ(r, [depth-0.5*sw/n_points, depth+0.5*sw/n_points], tree)
+    
+    for x in [depth, rel, cdf, ring_area]:
+        x.setflags(write=False)
+    return SapwoodProfile(r, tree, perc, sw, depth, rel, cdf, act, ring_area)
+
+
+def sap_volume(r,s1,s2,vout=False,perc=0.95,tree='beech',profile=None):
     r"""Estimate sap flow from sap velocity in inner sapwood measured with East30 sensors
 
     Calculates the sap flow after Gebauer et al. (2008) based on sap velocity measurements 
     by fitting of Gebauer-Weibull function to measured sap velocity at mid and inner point
     through a scaling factor (but not changing the empirical, tree-specific parameters).
+    The weighted squared misfit is quadratic in the scaling factor, thus the fit is solved
+    explicitly for all time steps at once.
 
     Parameters
     ----------
     r : float
         tree radius at breast height (in cm)
-    s1 : float or pandas.Series (datetime index is preferable)
+    s1 : float, numpy.ndarray or pandas.Series (datetime index is preferable)
         sap velocity measurement at mid point of East30 sensor (cm/time)
-    s2 : float or pandas.Series (datetime index is preferable)
+    s2 : float, numpy.ndarray or pandas.Series (datetime index is preferable)
         sap velocity measurement at inner point of East30 sensor (cm/time)
     vout : bool
         True returns aggregated volume flux (cm3/time), False returns velocity distribution (cm/time)
@@ -319,12 +444,14 @@ def sap_volume(r,s1,s2,vout=False,perc=0.95,tree='beech'):
     tree : str
         Tree name, for which to calculate bark thickness and Weibull function.
         Tree name has to be in gp.keys()
+    profile : SapwoodProfile
+        precalculated sapwood profile of the tree (has to match r, perc and tree)
 
     Returns
     -------
-    return : float or pandas.Series
-        aggregated volume flux (cm3/time) (if vout is True), or
-        returns velocity distribution (cm/time) (if vout is False)
+    return : float, numpy.ndarray or pandas.Series
+        aggregated volume flux (cm3/time) (if vout is False), or
+        returns velocity distribution (cm/time) over the 50 depth points (if vout is True)
 
     References
     ----------
@@ -334,27 +461,37 @@ def sap_volume(r,s1,s2,vout=False,perc=0.95,tree='beech'):
 
     """
 
-    xi = np.arange(50)/50.*gebauer(r,tree)
-    
-    def aply_geb(s1x):
-        dummy = s1x*gebauer_rel(r,tree)
-        er1 = (dummy[np.arange(50)/50.*gebauer(r,tree) >= 1.8][0]-s1)**2
-        er2 = (dummy[np.arange(50)/50.*gebauer(r,tree) >= 3.][0]-s2)**2
-        return np.sqrt(0.2*er1+er2)
-    
-    res = minimize_scalar(aply_geb)
-    dummy = res.x*gebauer_rel(r,tree)
-    v3 = dummy[(np.arange(50)/50.*gebauer(r,tree) > 2.4) & (np.arange(50)/50.*gebauer(r,tree) <= gebauer_act(r,perc,tree))]
-    
-    rx = (np.arange(50)/50.*gebauer(r,tree))[(np.arange(50)/50.*gebauer(r,tree) > 2.4) & (np.arange(50)/50.*gebauer(r,tree) <= gebauer_act(r,perc,tree))]
-    Ax = rx*np.nan
-    for i in np.arange(len(Ax)):
-        Ax = A_circ(r,[rx[i]-0.01*gebauer(r,tree),rx[i]+0.01*gebauer(r,tree)])
+    if profile is None:
+        profile = sapwood_profile(r,tree,perc)
+    else:
+        _match_profile(profile, r, tree, perc)
     
     if vout:
-        return dummy
+        [a, b] = _sap_fitpoints(profile)
+        sx = (0.2*a*np.asarray(s1, dtype=float) + b*np.asarray(s2, dtype=float)) / (0.2*a**2 + b**2)
+        return np.multiply.outer(sx, profile.rel)
+    
+    [w1, w2] = _sap_weights(profile)
+    if isinstance(s1, pd.Series):
+        return pd.Series(w1*s1.values + w2*np.asarray(s2, dtype=float), index=s1.index)
     else:
-        return np.sum(Ax * v3)
+        return w1*np.asarray(s1, dtype=float) + w2*np.asarray(s2, dtype=float)
+
+
+def _sap_fitpoints(profile):
+    # relative flux density at the mid (1.8 cm) and inner (3 cm) East30 sensor point
+    return [profile.rel[profile.depth >= 1.8][0], profile.rel[profile.depth >= 3.][0]]
+
+
+def _sap_weights(profile):
+    # The scaling factor s minimising 0.2*(s*a-s1)**2 + (s*b-s2)**2 (a, b are the relative 
+    # flux densities at the mid and inner sensor point) is linear in s1 and s2, and so is
+    # the integrated flow through the active inner sapwood. Returns the weights of s1 and s2.
+    [a, b] = _sap_fitpoints(profile)
+    mask = (profile.depth > 2.4) & (profile.depth <= profile.act)
+    # quadrature of the relative flux density over the rings of the active inner sapwood
+    flow = np.sum(profile.ring_area[mask] * profile.rel[mask])
+    return [flow*0.2*a/(0.2*a**2 + b**2), flow*b/(0.2*a**2 + b**2)]
 
 
 def A_circ(r,sens=[0.,1.1],tree='beech'):
@@ -385,7 +522,7 @@ def A_circ(r,sens=[0.,1.1],tree='beech'):
     return np.pi*((r-sens[0])**2) - np.pi*((r-sens[1])**2)
 
 
-def sap_calc(SV,r,perc=0.95,tree='beech'):
+def sap_calc(SV,r,perc=0.95,tree='beech',profile=None):
     r"""Wrapper for sap flow calculation with rootwater.sapflow.sap_volume
 
     Calculates the sap flow after Gebauer et al. (2008) based on measured sap velocity 
@@ -402,6 +539,8 @@ def sap_calc(SV,r,perc=0.95,tree='beech'):
     tree : str
         Tree name, for which to calculate bark thickness and Weibull function.
         Tree name has to be in gp.keys()
+    profile : SapwoodProfile
+        precalculated sapwood profile of the tree (has to match r, perc and tree)
 
     Returns
     -------
@@ -412,16 +551,94 @@ def sap_calc(SV,r,perc=0.95,tree='beech'):
     
     Sap = SV.copy()*np.nan
     colx = SV.columns[:3]
-    for i in Sap.index:
-        Sap.loc[i,colx[0]] = sap_volume(r,SV.loc[i,colx[1]],SV.loc[i,colx[0]],False,perc,tree)
-        Sap.loc[i,colx[1]] = SV.loc[i,colx[1]]*A_circ(r,[1.1,2.4],tree)
-        Sap.loc[i,colx[2]] = SV.loc[i,colx[2]]*A_circ(r,[0.,1.1],tree)
+    Sap[colx[0]] = sap_volume(r,SV[colx[1]].values,SV[colx[0]].values,False,perc,tree,profile)
+    Sap[colx[1]] = SV[colx[1]].values*A_circ(r,[1.1,2.4],tree)
+    Sap[colx[2]] = SV[colx[2]].values*A_circ(r,[0.,1.1],tree)
 
     return Sap
 
 
 
 
+def _sap_stand_chunk(V, W):
+    # sap flow through inner, mid and outer sapwood for stacked (3 x time x trees) velocities
+    # and (4 x trees) weights: inner sapwood from mid and inner velocity, mid and outer areas
+    return np.stack([W[0]*V[1] + W[1]*V[0], W[2]*V[1], W[3]*V[2]])
+
+
+def sap_stand(SV,inventory,perc=0.95,n_jobs=1,executor=None):
+    r"""Sap flow of a stand of trees
+
+    Calculates the sap flow of many trees (like rootwater.sapflow.sap_calc) in one
+    vectorized pass. The sapwood geometry of each tree of the inventory is calculated 
+    once. The species of the inventory are checked before any calculation: mixed 
+    stands are limited to the species with sapwood allometry (rootwater.sapflow.gebauer) 
+    and Weibull parameters (gp), which is only beech so far.
+
+    Parameters
+    ----------
+    SV : pandas.DataFrame
+        sap velocity (in cm/h) with datetime index, either wide with one column per 
+        sensor point or long with the columns id (tree id), position (one of inner, 
+        mid or outer) and sv
+    inventory : pandas.DataFrame
+        tree inventory indexed by tree id with the columns r (tree radius at breast 
+        height in cm), tree (tree name, 'beech' if missing) and for wide SV the columns
+        inner, mid and outer naming the sensor point columns in SV
+    perc : float
+        percentile to define the "zero" sap velocity limit
+    n_jobs : int
+        number of worker processes to distribute time chunks to 
+        (1 runs in one pass, -1 uses all cores)
+    executor : concurrent.futures.Executor
+        optional executor to map the time chunks with (overrides n_jobs)
+
+    Returns
+    -------
+    Sap : pandas.DataFrame
+        sap volume flux (cm3/h) indexed by time and tree id with the columns inner, mid, 
+        outer and total
+
+    Raises
+    ------
+    ValueError : if the inventory has trees without sapwood allometry and Weibull 
+        parameters (only 'beech' so far, see rootwater.sapflow.gebauer_act)
+
+    """
+    pos = ['inner', 'mid', 'outer']
+    trees = inventory['tree'].values if 'tree' in inventory.columns else ['beech']*len(inventory)
+    _check_trees(trees)
+    if {'id', 'position', 'sv'}.issubset(SV.columns):
+        SV = SV.set_index(['id', 'position'], append=True)['sv'].unstack(['id', 'position'])
+        sensors = [[(i, p) for i in inventory.index] for p in pos]
+    else:
+        sensors = [inventory[p].values for p in pos]
+    
+    # weights per tree
+    W = np.empty((4, len(inventory)))
+    for i, (r, tree) in enumerate(zip(inventory['r'].values.astype(float), trees)):
+        W[:2, i] = _sap_weights(sapwood_profile(r, tree, perc))
+        W[2, i] = A_circ(r, [1.1, 2.4], tree)
+        W[3, i] = A_circ(r, [0., 1.1], tree)
+    
+    V = np.stack([SV[s].values.astype(float) for s in sensors])
+    if (executor is None) & (n_jobs == 1):
+        Sap = _sap_stand_chunk(V, W)
+    else:
+        chunks = np.array_split(np.arange(V.shape[1]), os.cpu_count() if n_jobs in (None, -1) else n_jobs)
+        if executor is not None:
+            res = list(executor.map(_sap_stand_chunk, [V[:, c] for c in chunks], [W]*len(chunks)))
+        else:
+            with ProcessPoolExecutor(max_workers=len(chunks)) as ex:
+                res = list(ex.map(_sap_stand_chunk, [V[:, c] for c in chunks], [W]*len(chunks)))
+        Sap = np.concatenate(res, axis=1)
+    
+    Sap = pd.DataFrame(Sap.reshape(3, -1).T, columns=pos,
+                       index=pd.MultiIndex.from_product([SV.index, inventory.index], names=['time', 'id']))
+    Sap['total'] = Sap[pos].sum(axis=1, skipna=False)
+    return Sap
+
+
 def stackplot(A):
     import matplotlib.pyplot as plt
     r"""plot stacked time series (of first three columns of the provided dataframe)
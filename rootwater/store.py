@@ -0,0 +1,238 @@
+"""
+The result store
+================
+
+Typed, columnar files for the results of the RWU and sap flow functions (e.g.
+rootwater.rootwater.fRWU, rootwater.rootwater.dfRWUc or rootwater.sapflow.sap_stand),
+which can be loaded again without parsing text and column by column.
+
+Time stamps (the index and the tin/tout/tix columns of fRWU) are stored as
+datetime64 and the quality control codes (step_control and evalx) as 16 bit
+integers. Three formats are supported and chosen by the file extension:
+
+* ``.parquet`` (Apache Parquet) and ``.feather`` (Arrow IPC, memory-mapped on
+  reading) which require the optional dependency pyarrow
+* ``.npz`` (uncompressed NumPy archive) as fallback without further dependencies,
+  of which only the requested columns are read
+
+.. note::
+    A directory of result files (e.g. one part per sensor or year) is read as one
+    data frame with rootwater.store.read_results.
+
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+FORMATS = {'.parquet': 'parquet', '.pq': 'parquet', '.feather': 'feather', '.arrow': 'feather', '.npz': 'npz'}
+
+# columns of fRWU holding time stamps and quality control codes
+TIME_COLUMNS = ['tin', 'tout', 'tix']
+CODE_COLUMNS = ['step_control', 'evalx']
+
+# name for unnamed index levels in the files
+_INDEX = '__index__'
+
+def _format(path, format=None):
+    # storage format from the argument or the file extension
+    if format is None:
+        format = FORMATS.get(os.path.splitext(str(path))[1].lower())
+        if format is None:
+            raise ValueError('unknown result file extension of '+str(path)+' (use one of '+', '.join(FORMATS)+')')
+    if format not in FORMATS.values():
+        raise ValueError("format has to be one of 'parquet', 'feather' or 'npz'")
+    return format
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:
+        raise ImportError('pyarrow is required for parquet and feather files, use a .npz file instead')
+    return pyarrow
+
+def typed(df):
+    r"""Return a copy of a result data frame with typed columns
+
+    The tin, tout and tix columns become datetime64 and the step_control and evalx
+    codes nullable 16 bit integers (pandas.Int16Dtype). Other columns are left as they are.
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        results (e.g. of rootwater.rootwater.fRWU)
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        results with typed columns
+    """
+    df = df.copy()
+    for c in df.columns:
+        if (c in TIME_COLUMNS) & (not pd.api.types.is_datetime64_any_dtype(df[c])):
+            df[c] = pd.to_datetime(df[c].where(df[c].notna(), pd.NaT))
+        elif c in CODE_COLUMNS:
+            df[c] = df[c].astype('Int16')
+    return df
+
+def _flat(df):
+    # typed frame with the index as columns, the index names and the units of the 
+    # time stamps (not all of which are supported by every format)
+    df = typed(df)
+    names = [_INDEX if n is None else str(n) for n in df.index.names]
+    df.index.names = names
+    df = df.reset_index()
+    df.columns = [str(c) for c in df.columns]
+    units = {c: df[c].dt.unit for c in df.columns if pd.api.types.is_datetime64_any_dtype(df[c])}
+    return df, names, units
+
+def _unflat(df, names, units):
+    # restore the index and time stamp units of a frame read from a file
+    for c in units:
+        if c in df.columns:
+            df[c] = df[c].dt.as_unit(units[c])
+    df = df.set_index(names)
+    df.index.names = [None if n == _INDEX else n for n in df.index.names]
+    return df
+
+def write_results(df, path, format=None):
+    r"""Write results to a typed, columnar file
+
+    Parameters
+    ----------
+    df : pandas.DataFrame
+        results (e.g. of rootwater.rootwater.fRWU or rootwater.sapflow.sap_stand)
+    path : str
+        file name, the extension (.parquet, .feather or .npz) sets the format
+    format : str
+        optional format ('parquet', 'feather' or 'npz') overriding the extension
+
+    Returns
+    -------
+    path : str
+        the written file
+    """
+    format = _format(path, format)
+    flat, names, units = _flat(df)
+    if format == 'npz':
+        _write_npz(flat, names, units, path)
+        return path
+
+    pa = _pyarrow()
+    table = pa.Table.from_pandas(flat, preserve_index=False)
+    meta = dict(table.schema.metadata or {})
+    meta[b'rootwater'] = json.dumps({'index': names, 'unit': units}).encode()
+    table = table.replace_schema_metadata(meta)
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        pq.write_table(table, path)
+    else:
+        import pyarrow.feather as feather
+        feather.write_feather(table, path)
+    return path
+
+def read_results(path, columns=None, format=None):
+    r"""Read results written with rootwater.store.write_results
+
+    Parameters
+    ----------
+    path : str
+        file name or directory of result files (read in sorted order and concatenated)
+    columns : list of str
+        optional selection of columns to read (the index is always read)
+    format : str
+        optional format ('parquet', 'feather' or 'npz') overriding the extension
+
+    Returns
+    -------
+    df : pandas.DataFrame
+        results with typed columns
+    """
+    if os.path.isdir(path):
+        files = [os.path.join(path, f) for f in sorted(os.listdir(path))
+                 if os.path.splitext(f)[1].lower() in FORMATS]
+        if len(files) == 0:
+            raise ValueError('no result files in '+str(path))
+        return _concat([read_results(f, columns, format) for f in files])
+
+    format = _format(path, format)
+    if format == 'npz':
+        return _read_npz(path, columns)
+
+    _pyarrow()
+    if format == 'parquet':
+        import pyarrow.parquet as pq
+        schema = pq.read_schema(path)
+        read = lambda cols: pq.read_table(path, columns=cols, memory_map=True)
+    else:
+        import pyarrow.feather as feather
+        import pyarrow.ipc as ipc
+        schema = ipc.open_file(path).schema
+        read = lambda cols: feather.read_table(path, columns=cols, memory_map=True)
+    meta = json.loads(schema.metadata[b'rootwater'])
+    cols = None if columns is None else meta['index'] + [str(c) for c in columns]
+    return _unflat(read(cols).to_pandas(), meta['index'], meta['unit'])
+
+def _concat(parts):
+    # concatenate parts with time stamps in the finest unit of all parts (and the time 
+    # zone of the others for parts without any time stamps in a column)
+    order = ['s', 'ms', 'us', 'ns']
+    for c in parts[0].columns:
+        if all(pd.api.types.is_datetime64_any_dtype(p[c]) for p in parts):
+            unit = max((p[c].dt.unit for p in parts), key=order.index)
+            tz = [p[c].dt.tz for p in parts if p[c].dt.tz is not None]
+            for p in parts:
+                p[c] = p[c].dt.as_unit(unit)
+                if (p[c].dt.tz is None) & (len(tz) > 0) & p[c].isna().all():
+                    p[c] = p[c].dt.tz_localize(tz[0])
+    return pd.concat(parts)
+
+def _write_npz(flat, names, units, path):
+    # one array per column with the column kinds in a json header
+    arrays = {}
+    meta = {'index': names, 'columns': list(flat.columns), 'kinds': {}, 'tz': {}, 'unit': units}
+    for c in flat.columns:
+        x = flat[c]
+        if pd.api.types.is_datetime64_any_dtype(x):
+            t = pd.DatetimeIndex(x)
+            meta['kinds'][c] = 'datetime'
+            meta['tz'][c] = None if t.tz is None else str(t.tz)
+            arrays[c] = t.asi8
+        elif pd.api.types.is_integer_dtype(x) & isinstance(x.dtype, pd.api.extensions.ExtensionDtype):
+            meta['kinds'][c] = str(x.dtype)
+            arrays[c] = x.fillna(0).to_numpy(dtype=x.dtype.numpy_dtype)
+            if x.isna().any():
+                arrays[c+'.na'] = x.isna().to_numpy()
+        elif pd.api.types.is_numeric_dtype(x) or pd.api.types.is_bool_dtype(x):
+            meta['kinds'][c] = 'numeric'
+            arrays[c] = x.to_numpy()
+        else:
+            meta['kinds'][c] = 'str'
+            arrays[c] = x.astype(str).to_numpy(dtype=str)
+    arrays['__meta__'] = np.array(json.dumps(meta))
+    with open(path, 'wb') as f:
+        np.savez(f, **arrays)
+
+def _read_npz(path, columns=None):
+    # only the members of the requested columns are read from the archive
+    with np.load(path, allow_pickle=False) as z:
+        meta = json.loads(str(z['__meta__']))
+        names = meta['index']
+        cols = meta['columns'] if columns is None else names + [str(c) for c in columns]
+        data = {}
+        for c in cols:
+            if c not in meta['kinds']:
+                raise KeyError(str(c)+' is not a column of '+str(path))
+            kind = meta['kinds'][c]
+            x = z[c]
+            if kind == 'datetime':
+                x = pd.DatetimeIndex(x.view('datetime64['+meta['unit'][c]+']'))
+                if meta['tz'][c] is not None:
+                    x = x.tz_localize('UTC').tz_convert(meta['tz'][c])
+            elif kind not in ('numeric', 'str'):
+                x = pd.array(x, dtype=kind)
+                if c+'.na' in z.files:
+                    x[z[c+'.na']] = pd.NA
+            data[c] = x
+    return _unflat(pd.DataFrame(data, columns=cols), names, meta['unit'])
@@ -1,11 +1,17 @@
 import unittest
+from unittest import mock
 
+import importlib.util
+import json
 import os
+import subprocess
+import sys
+import tempfile
 import numpy as np
 import pandas as pd
 from numpy.testing import assert_almost_equal
 
-from rootwater import rw, sf
+from rootwater import cli, rw, sf, store, vg
 
 # get the basebath for test reference files
 BASEPATH = os.path.abspath(os.path.dirname(__file__))
@@ -30,8 +36,208 @@ class TestIt(unittest.TestCase):
             self.RWUtest.values,
             decimal=2
             )
+
+
+    def test_RWU_methods(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        for i in ts.columns:
+            ref = rw.fRWU(ts[i], method='statsmodels')
+            res = rw.fRWU(ts[i], method='numpy')
+            assert_almost_equal(
+                res.iloc[:, :7].to_numpy(dtype=float, na_value=np.nan),
+                ref.iloc[:, :7].to_numpy(dtype=float, na_value=np.nan),
+                decimal=8
+            )
+            self.assertTrue(res[['tin', 'tout', 'tix']].equals(ref[['tin', 'tout', 'tix']]))
+            self.assertTrue(res.dtypes.equals(ref.dtypes))
+        self.assertEqual([str(i) for i in res.dtypes.iloc[[0, 4, 5]]], ['float64', 'Int16', 'Int16'])
+        self.assertEqual(str(res.tin.dt.tz), 'Etc/GMT-1')
         
 
+    def test_RWU_kernels(self):
+        from rootwater import _kernels
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        kernel = _kernels.rwu_days
+        try:
+            # the loop of the compiled kernel also runs as plain python without numba
+            _kernels.rwu_days = kernel or _kernels._rwu_days
+            for i in ts.columns:
+                self.assertTrue(rw.fRWU(ts[i], engine='numba').equals(rw.fRWU(ts[i], engine='numpy')))
+        finally:
+            _kernels.rwu_days = kernel
+        if kernel is None:
+            with self.assertRaises(ImportError):
+                rw.fRWU(ts[ts.columns[0]], engine='numba')
+
+    def test_RWU_smoothing(self):
+        from scipy.ndimage import gaussian_filter1d
+        SM = self.SMtest.copy()
+        SM.iloc[40:43, 0] = np.nan
+        SM.iloc[-5:, 1] = np.nan
+        dif = rw.smoothed_change(SM)
+        for i, c in enumerate(SM.columns):
+            assert_almost_equal(dif[:, i], gaussian_filter1d(SM[c].diff(3), 1))
+        # gaps at the edges do not break the Savitzky-Golay filter
+        res = rw.dfRWUc(SM, savgol=True)
+        self.assertEqual(res[0].shape, (len(rw.fRWU(SM[SM.columns[0]].tz_localize('Etc/GMT-1'))), len(SM.columns)))
+
+    def test_RWU_sweep(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        cube = rw.sweepRWU(self.SMtest, diffx=[2, 3], maxdiffs=[0.1, 0.25], mintime=[3., 3.5])
+        self.assertEqual(list(cube.index.names), ['diffx', 'slope_diff', 'maxdiffs', 'mintime', 'time', 'id'])
+        self.assertEqual(len(cube), 8*len(ts.columns)*len(rw.fRWU(ts[ts.columns[0]])))
+        for d, m, t in [(2, 0.1, 3.), (3, 0.25, 3.5), (3, 0.1, 3.5)]:
+            for i in ts.columns:
+                res = cube.xs((d, 3, m, t, i), level=['diffx', 'slope_diff', 'maxdiffs', 'mintime', 'id'])
+                self.assertTrue(res.equals(rw.fRWU(ts[i], diffx=d, maxdiffs=m, mintime=t).rename_axis('time')))
+
+    def test_RWU_ensemble(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        ref = rw.fRWU(ts[ts.columns[0]])
+        ens = rw.ensembleRWU(ts[ts.columns[0]], n=200, seed=1)
+        self.assertEqual(list(ens.columns), [(v, q) for v in ['rwu', 'rwu_nonight'] for q in [0.05, 0.5, 0.95]])
+        self.assertTrue(ens.index.equals(ref.index))
+        self.assertTrue(ens['rwu'][0.05].isna().equals(ref.rwu.isna()))
+        self.assertTrue((ens['rwu'][0.05] <= ens['rwu'][0.95]).where(ref.rwu.notna(), True).all())
+        self.assertTrue(ens.equals(rw.ensembleRWU(ts[ts.columns[0]], n=200, seed=1)))
+        # without noise and shifts every member is the point estimate
+        ens = rw.ensembleRWU(ts[ts.columns[0]], n=5, noise=0., shift=0, q=0.5)
+        self.assertTrue(np.allclose(ens['rwu'][0.5], ref.rwu, equal_nan=True))
+        self.assertTrue(np.allclose(ens['rwu_nonight'][0.5], ref.rwu_nonight, equal_nan=True))
+        # a given plan is used as it is, even if it has no days
+        plan = rw.RWUPlan(ts.index)
+        with mock.patch.object(rw, 'RWUPlan', side_effect=AssertionError), \
+                mock.patch.object(type(plan), '__len__', return_value=0):
+            self.assertTrue(rw.ensembleRWU(ts[ts.columns[0]], n=20, seed=1, plan=plan).equals(
+                rw.ensembleRWU(ts[ts.columns[0]], n=20, seed=1, plan=plan)))
+        ens = rw.ensembleRWU(ts, n=50, seed=1)
+        self.assertEqual(list(ens.index.names), ['time', 'id'])
+        self.assertEqual(len(ens), len(ts.columns)*len(ref))
+
+    def test_RWU_short(self):
+        # a single day has no evaluable window
+        ts = self.SMtest.tz_localize('Etc/GMT-1').iloc[:24]
+        for i in ts.columns[:2]:
+            res = rw.fRWU(ts[i])
+            self.assertTrue(res.rwu.isna().all())
+            self.assertTrue(res.equals(rw.fRWU(ts[i], method='statsmodels')))
+        self.assertEqual(len(rw.dfRWUc(self.SMtest.iloc[:10])[0]), 1)
+
+    def test_RWU_plan(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        plan = rw.RWUPlan(ts.index)
+        self.assertEqual(len(plan), len(rw.fRWU(ts[ts.columns[0]])))
+        for i in ts.columns:
+            self.assertTrue(rw.fRWU(ts[i], plan=plan).equals(rw.fRWU(ts[i])))
+        with self.assertRaises(ValueError):
+            rw.fRWU(ts[ts.columns[0]].iloc[1:], plan=plan)
+
+    def test_RWU_report(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        [res, rep] = rw.fRWU(ts[ts.columns[0]], report=True)
+        self.assertTrue(res.equals(rw.fRWU(ts[ts.columns[0]])))
+        self.assertEqual(set(rep.days), set(res.index.date[:-1]))
+        self.assertTrue({'solar', 'smoothing', 'windows', 'nse', 'fits'}.issubset(rep.timings))
+        self.assertEqual(rep.calls['windows'], 1)
+        self.assertEqual(len(rw.dfRWUc(self.SMtest, report=True)[3]), len(ts.columns))
+
+    def test_RWU_parallel(self):
+        ref = rw.dfRWUc(self.SMtest)
+        for res, refx in zip(rw.dfRWUc(self.SMtest, n_jobs=2), ref):
+            self.assertTrue(res.equals(refx))
+
+    def test_RWU_stream(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        for i in ts.columns:
+            ref = rw.fRWU(ts[i]).iloc[:-1]
+            stream = rw.RWUStream()
+            res = [stream.update(ts[i].iloc[j:j+5]) for j in np.arange(0, len(ts), 5)]
+            res = pd.concat(res + [stream.flush()])
+            assert_almost_equal(
+                res.iloc[:, :7].to_numpy(dtype=float, na_value=np.nan),
+                ref.iloc[:, :7].to_numpy(dtype=float, na_value=np.nan)
+            )
+            self.assertTrue(res[['tin', 'tout', 'tix']].equals(ref[['tin', 'tout', 'tix']]))
+
+    def test_RWU_stream_unsorted(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')[self.SMtest.columns[0]]
+        ref = rw.fRWU(ts).iloc[:-1]
+        stream = rw.RWUStream()
+        # chunks in reverse order overlapping the previous one
+        res = [stream.update(ts.iloc[max(0, j-2):j+5].iloc[::-1]) for j in np.arange(0, len(ts), 5)]
+        self.assertTrue(stream.buffer.index.is_monotonic_increasing)
+        self.assertTrue(stream.buffer.equals(ts))
+        res = pd.concat(res + [stream.flush()])
+        self.assertTrue(res[['tin', 'tout', 'tix']].equals(ref[['tin', 'tout', 'tix']]))
+
+    def test_RWU_csv(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        with tempfile.TemporaryDirectory() as tmp:
+            parts = rw.csvRWU(os.path.join(BASEPATH, 'SM_test.csv'), tmp, chunksize=20)
+            self.assertTrue(len(parts) > 1)
+            res = store.read_results(tmp)
+        for i in ts.columns:
+            self.assertTrue(res.xs(i, level='id').equals(rw.fRWU(ts[i]).iloc[:-1]))
+
+    def test_cli(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        inventory = {'Slate': {'r': 32., 'inner': 'Slate_SV_inner', 'mid': 'Slate_SV_mid', 'outer': 'Slate_SV_outer'}}
+        manifest = {'output': 'out', 'sites': {'A': {'soil_moisture': os.path.join(BASEPATH, 'SM_test.csv'),
+                    'sap_velocity': os.path.join(BASEPATH, 'SV_test.csv'), 'inventory': inventory}}}
+        with tempfile.TemporaryDirectory() as tmp:
+            fname = os.path.join(tmp, 'sites.json')
+            with open(fname, 'w') as f:
+                json.dump(manifest, f)
+            self.assertEqual(cli.main([fname, '-j', '2', '-q']), 0)
+            rwu = store.read_results(os.path.join(tmp, 'out', 'A', 'rwu'))
+            sap = store.read_results(os.path.join(tmp, 'out', 'A', 'sapflow'))
+            # finished jobs are skipped when run again
+            summary = cli.run(fname, log=None)
+            self.assertEqual((summary['skipped'], summary['done']), (len(ts.columns) + 1, 0))
+            # every file of a site is read once and its sensors share one plan
+            with mock.patch.object(cli, '_read', wraps=cli._read) as read, \
+                    mock.patch.object(rw, 'RWUPlan', wraps=rw.RWUPlan) as plan:
+                summary = cli.run(fname, n_jobs=1, overwrite=True, log=None)
+            self.assertEqual((summary['done'], read.call_count, plan.call_count), (len(ts.columns) + 1, 2, 1))
+            self.assertTrue(store.read_results(os.path.join(tmp, 'out', 'A', 'rwu')).equals(rwu))
+            # a missing column only fails its own job of the group
+            manifest = cli.read_manifest(fname)
+            manifest['sites']['A']['columns'] = [ts.columns[0], 'nosuch']
+            results = cli.run_group([j for j in cli.make_jobs(manifest) if j['kind'] == 'rwu'])
+            self.assertEqual(results[0][0], len(ts))
+            self.assertIsInstance(results[1], ValueError)
+        for i in ts.columns:
+            self.assertTrue(rwu.xs(i, level='id').equals(rw.fRWU(ts[i]).rename_axis('time')))
+        assert_almost_equal(sap[['inner', 'mid', 'outer']].values, self.SFtest.values, decimal=2)
+
+    def test_solar_table(self):
+        tab = rw.solar_table(49.70764, 5.897638, 200., 'Etc/GMT-1', '2017-06-13', '2017-06-16')
+        self.assertEqual(len(tab), 4)
+        self.assertTrue((tab.sunrise < tab.sunset).all())
+        with tempfile.TemporaryDirectory() as tmp:
+            rw.solar_table(49.70764, 5.897638, 200., 'Etc/GMT-1', '2017-06-13', '2017-06-16', cache_dir=tmp)
+            self.assertEqual(len(os.listdir(tmp)), 1)
+            self.assertTrue(tab.equals(
+                rw.solar_table(49.70764, 5.897638, 200., 'Etc/GMT-1', '2017-06-13', '2017-06-16', cache_dir=tmp)))
+        
+
+    def test_store(self):
+        ts = self.SMtest.tz_localize('Etc/GMT-1')
+        res = rw.fRWU(ts[ts.columns[0]])
+        formats = ['npz'] + (['parquet', 'feather'] if importlib.util.find_spec('pyarrow') else [])
+        with tempfile.TemporaryDirectory() as tmp:
+            for f in formats:
+                fname = store.write_results(res, os.path.join(tmp, 'rwu.' + f))
+                x = store.read_results(fname)
+                self.assertTrue(x.equals(store.typed(res)))
+                self.assertEqual(str(x.step_control.dtype), 'Int16')
+                self.assertTrue(x.tin.dt.tz is not None)
+                self.assertEqual(list(store.read_results(fname, columns=['rwu']).columns), ['rwu'])
+            os.mkdir(os.path.join(tmp, 'parts'))
+            store.write_results(res.iloc[:2], os.path.join(tmp, 'parts', 'a.npz'))
+            store.write_results(res.iloc[2:], os.path.join(tmp, 'parts', 'b.npz'))
+            self.assertTrue(store.read_results(os.path.join(tmp, 'parts')).equals(store.typed(res)))
+
     def test_SF(self):
         assert_almost_equal(
             sf.sap_calc(self.SVtest,32.,0.95,'beech').values,
@@ -40,5 +246,141 @@ class TestIt(unittest.TestCase):
         )
 
 
+    def test_sap_volume_rings(self):
+        # flow through the active inner sapwood of a coarse (10 point) profile, summed 
+        # ring by ring with the scaling of the weighted misfit at the sensor points
+        from scipy.optimize import minimize_scalar
+        r, n, s1, s2 = 32., 10, 12., 7.
+        prof = sf.sapwood_profile(r, 'beech', 0.95, n)
+        rb = r - sf.roessler(r)/2.
+        dz = sf.gebauer(r)/n
+        p = sf.gp['beech']
+        rel = lambda x: sf.gebauer_weibull(x, p['a'], p['b'], p['c'], p['d'])
+        scale = minimize_scalar(lambda k: 0.2*(k*rel(2*dz) - s1)**2 + (k*rel(3*dz) - s2)**2).x
+        flow = 0.
+        for i in range(n):
+            if (i*dz > 2.4) & (i*dz <= prof.act):
+                ring = np.pi*(rb - (i - 0.5)*dz)**2 - np.pi*(rb - (i + 0.5)*dz)**2
+                flow += ring*rel(i*dz)*scale
+        # five rings from 2.8 to 8.5 cm depth
+        self.assertEqual(((prof.depth > 2.4) & (prof.depth <= prof.act)).sum(), 5)
+        assert_almost_equal(sf.sap_volume(r, s1, s2, profile=prof), flow, decimal=4)
+
+    def test_sap_stand(self):
+        inventory = pd.DataFrame({'r': [32.], 'tree': ['beech'], 'inner': ['Slate_SV_inner'],
+                                  'mid': ['Slate_SV_mid'], 'outer': ['Slate_SV_outer']}, index=['Slate'])
+        res = sf.sap_stand(self.SVtest, inventory)
+        assert_almost_equal(
+            res.xs('Slate', level='id')[['inner', 'mid', 'outer']].values,
+            self.SFtest.values,
+            decimal=2
+        )
+        # unsupported species fail before any work is dispatched
+        mixed = pd.concat([inventory, inventory.rename({'Slate': 'B'}).assign(tree='hornbeam')])
+        executor = mock.Mock()
+        with self.assertRaisesRegex(ValueError, 'hornbeam'):
+            sf.sap_stand(self.SVtest, mixed, executor=executor)
+        executor.map.assert_not_called()
+
+    def test_sapwood_profile(self):
+        prof = sf.sapwood_profile(32., 'beech', 0.95)
+        self.assertTrue(prof is sf.sapwood_profile(32., 'beech', 0.95))
+        self.assertEqual(prof.act, sf.gebauer_act(32., 0.95, 'beech'))
+        assert_almost_equal(
+            sf.sap_calc(self.SVtest, 32., profile=prof).values,
+            self.SFtest.values,
+            decimal=2
+        )
+        self.assertEqual(sf.gebauer(32., profile=prof), sf.gebauer(32.))
+        assert_almost_equal(sf.gebauer_rel(32., profile=prof), sf.gebauer_rel(32.))
+        self.assertEqual(sf.gebauer_act(32., profile=prof), prof.act)
+        # a profile of another tree is not silently used
+        for kwargs in [dict(r=40.), dict(perc=0.9)]:
+            with self.assertRaisesRegex(ValueError, list(kwargs)[0]):
+                sf.sap_calc(self.SVtest, **dict(dict(r=32., perc=0.95), **kwargs), profile=prof)
+        with self.assertRaisesRegex(ValueError, 'n_points'):
+            sf.gebauer_rel(32., n_points=20, profile=prof)
+
+
+    def test_gebauer_act(self):
+        r = np.array([15., 20., 32., 40., 55.])
+        assert_almost_equal(
+            sf.gebauer_act(r, 0.95, np.array(['beech']*5)),
+            [sf.gebauer_act(float(i), 0.95, 'beech') for i in r]
+        )
+        self.assertEqual(sf.gebauer_act(np.float64(32.)), sf.gebauer_act(32.))
+        with self.assertRaisesRegex(ValueError, 'hornbeam'):
+            sf.gebauer_act(r, 0.95, np.array(['beech', 'hornbeam']*2 + ['beech']))
+
+    def test_gebauer_rel(self):
+        # every tree of gp has a relative flux density on the (beech) depth grid
+        x = np.arange(50)/50.*sf.gebauer(32.)
+        for t, p in sf.gp.items():
+            assert_almost_equal(sf.gebauer_rel(32., t), sf.gebauer_weibull(x, p['a'], p['b'], p['c'], p['d']))
+        with self.assertRaises(ValueError):
+            sf.gebauer_rel(32., 'oak')
+
+    def test_gebauer_act_mixed(self):
+        # oak has allometry but no Weibull parameters, borrow some for a second species
+        r = np.array([15., 20., 32., 40., 55.])
+        trees = np.array(['beech', 'oak', 'oak', 'beech', 'oak'])
+        with self.assertRaisesRegex(ValueError, 'oak'):
+            sf.gebauer_act(r, 0.95, trees)
+        try:
+            with mock.patch.dict(sf.gp, {'oak': sf.gp['hornbeam']}):
+                sf.sapwood_profile.cache_clear()
+                act = sf.gebauer_act(r, 0.95, trees)
+                assert_almost_equal(act, [sf.gebauer_act(float(i), 0.95, t) for i, t in zip(r, trees)])
+                self.assertNotAlmostEqual(act[1], sf.gebauer_act(20., 0.95, 'beech'))
+        finally:
+            sf.sapwood_profile.cache_clear()
+
+    def test_lazy_imports(self):
+        cmd = ("import sys, rootwater; from rootwater import rw, sf; "
+               "print(sorted(m for m in ['statsmodels', 'scipy', 'astral', 'hydroeval'] if m in sys.modules))")
+        out = subprocess.run([sys.executable, '-c', cmd], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(BASEPATH)))
+        self.assertEqual(out.stdout.strip(), '[]')
+        # submodules by their full names and aliases
+        cmd = ("import rootwater; "
+               "print(rootwater.rootwater.fRWU is rootwater.rw.fRWU, rootwater.sapflow.sap_calc is rootwater.sf.sap_calc, "
+               "rootwater.vangenuchten is rootwater.vg, rootwater.store.read_results is not None, "
+               "rootwater.cli.main is not None)")
+        out = subprocess.run([sys.executable, '-c', cmd], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.dirname(BASEPATH)))
+        self.assertEqual(out.stdout.split(), ['True']*5)
+
+    def test_vg(self):
+        params = vg.read_params(os.path.join(BASEPATH, '..', '..', 'docs', 'examples', 'vG_RWU.csv'))
+        self.assertEqual(list(params.columns), ['ths', 'thr', 'alpha', 'n', 'm', 'ks'])
+        [ths, thr, alpha, n, m, ks] = [params[i].values for i in params.columns]
+        theta = np.linspace(thr + 1., ths - 1., 200)
+        psi = vg.psi_theta(theta, ths, thr, alpha, n, m)
+        self.assertEqual(psi.shape, (200, 4))
+        assert_almost_equal(vg.theta_psi(psi, ths, thr, alpha, n, m), theta)
+        assert_almost_equal(vg.psi_theta(theta[:, 2], ths[2], thr[2], alpha[2], n[2], m[2]), psi[:, 2])
+
+        lut = vg.LookupTable.from_params(params, resolution=2000)
+        self.assertEqual(lut.psi.shape, (2000, 4))
+        assert_almost_equal(lut.psi_theta(theta, np.arange(4)) / psi, 1., decimal=2)
+        assert_almost_equal(lut.theta_psi(psi, np.arange(4)), theta, decimal=2)
+        assert_almost_equal(lut.ku_theta(theta, np.arange(4)) / vg.ku_theta(theta, ths, thr, ks, alpha, n, m), 1., decimal=1)
+
+    def test_vg_soiltable(self):
+        params = vg.read_params(os.path.join(BASEPATH, '..', '..', 'docs', 'examples', 'vG_RWU.csv'))
+        sample = params.index[[0, 0, 1, 3]]
+        soils = vg.SoilTable(params.rename(columns={'ths': 'ts', 'thr': 'tr'}), sample)
+        self.assertEqual(len(soils), 4)
+        SM = pd.DataFrame(np.linspace(10., 40., 40).reshape(10, 4), columns=list('abcd'))
+        psi = soils.psi_theta(SM)
+        self.assertTrue(psi.columns.equals(SM.columns))
+        for i, j in enumerate(sample):
+            p = params.loc[j]
+            assert_almost_equal(psi.iloc[:, i].values, vg.psi_theta(SM.iloc[:, i].values, p.ths, p.thr, p.alpha, p.n, p.m))
+        assert_almost_equal(soils.theta_psi(psi).values, SM.values)
+        D, ku, theta = soils.Dku_thst(np.full((3, 4), 0.5))
+        self.assertEqual(D.shape, (3, 4))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,390 @@
+"""
+The van Genuchten toolbox
+=========================
+
+Conversions between soil moisture, matric head, hydraulic conductivity and
+diffusivity after van Genuchten (1980) and Mualem (1976), e.g. to convert soil
+moisture and RWU estimates to matric potentials and fluxes. All conversions
+broadcast their arguments, so that several soils (parameter vectors) can be
+evaluated for arrays of readings in one call.
+
+.. note::
+    For repeated conversions of large records, use rootwater.vangenuchten.LookupTable
+    which interpolates precomputed tables of a configurable resolution. Parameter
+    files like docs/examples/vG_RWU.csv are read (and cached) with
+    rootwater.vangenuchten.read_params.
+
+References
+----------
+Carsel, R. F., and R. S. Parrish (1988), Developing joint probability distributions
+of soil water retention characteristics, Water Resour. Res., 24(5), 755–769.
+
+van Genuchten, M. T. (1980), A closed-form equation for predicting the hydraulic
+conductivity of unsaturated soils, Soil Sci. Soc. Am. J., 44(5), 892–898.
+"""
+import functools
+import os
+
+import numpy as np
+import pandas as pd
+
+# standard parameters after Carsel & Parrish 1988
+carsel=pd.DataFrame(
+[[  'C', 30.,  15.,  55.,   0.068,   0.38,   0.008*100.,   1.09,    0.200/360000.],
+[  'CL', 37.,  30.,  33.,   0.095,   0.41,   0.019*100.,   1.31,    0.258/360000.],
+[   'L', 40.,  40.,  20.,   0.078,   0.43,   0.036*100.,   1.56,    1.042/360000.],
+[  'LS', 13.,  81.,   6.,   0.057,   0.43,   0.124*100.,   2.28,   14.592/360000.],
+[   'S',  4.,  93.,   3.,   0.045,   0.43,   0.145*100.,   2.68,   29.700/360000.],
+[  'SC', 11.,  48.,  41.,   0.100,   0.38,   0.027*100.,   1.23,    0.121/360000.],
+[ 'SCL', 19.,  54.,  27.,   0.100,   0.39,   0.059*100.,   1.48,    1.308/360000.],
+[  'SI', 85.,   6.,   9.,   0.034,   0.46,   0.016*100.,   1.37,    0.250/360000.],
+[ 'SIC', 48.,   6.,  46.,   0.070,   0.36,   0.005*100.,   1.09,    0.021/360000.],
+['SICL', 59.,   8.,  33.,   0.089,   0.43,   0.010*100.,   1.23,    0.071/360000.],
+[ 'SIL', 65.,  17.,  18.,   0.067,   0.45,   0.020*100.,   1.41,    0.450/360000.],
+[  'SL', 26.,  63.,  11.,   0.065,   0.41,   0.075*100.,   1.89,    4.421/360000.]],
+columns=['Typ','Silt','Sand','Clay','thr','ths','alpha','n','ks'],index=np.arange(12).astype(int)+1)
+
+def _m(n, m=None):
+    # shape parameter m after Mualem (1976) if not given
+    if m is None:
+        return 1.-1./np.asarray(n, dtype=float)
+    return m
+
+def _psi98(alpha, n, m):
+    # matric head at 98 % relative saturation (replaces infinite heads as in vG_conv.py)
+    return -1./alpha * ( (1-0.98**(1/m))/(0.98**(1/m)) )**(1./n)
+
+# conversions
+@np.errstate(all='ignore')
+def thst_theta(theta, ths, thr):
+    r"""Relative saturation (theta*) from soil moisture (theta)"""
+    return (np.asarray(theta, dtype=float)-thr)/(ths-thr)
+
+@np.errstate(all='ignore')
+def theta_thst(th_star, ths, thr):
+    r"""Soil moisture (theta) from relative saturation (theta*)"""
+    return np.asarray(th_star, dtype=float)*(ths-thr)+thr
+
+@np.errstate(all='ignore')
+def thst_psi(psi, alpha, n, m=None):
+    r"""Relative saturation (theta*) from matric head (psi)"""
+    m = _m(n, m)
+    return (1./(1.+(np.abs(psi)*alpha)**n))**m
+
+@np.errstate(all='ignore')
+def psi_thst(th_star, alpha, n, m=None):
+    r"""Matric head (psi) from relative saturation (theta*)
+
+    Infinite heads (at zero relative saturation) are replaced by the head at 98 %
+    relative saturation like in the original conversion script.
+    """
+    m = _m(n, m)
+    th_star = np.asarray(th_star, dtype=float)
+    psi = -1./alpha * ( (1-th_star**(1/m))/(th_star**(1/m)) )**(1./n)
+    return np.where(np.isinf(psi), _psi98(alpha, n, m), psi)
+
+@np.errstate(all='ignore')
+def psi_theta(theta, ths, thr, alpha, n, m=None):
+    r"""Matric head (psi) from soil moisture (theta) (see rootwater.vangenuchten.psi_thst)"""
+    m = _m(n, m)
+    th_star = thst_theta(theta, ths, thr)
+    psi = -1. * ( (1 - th_star**(1./m)) / (th_star**(1./m)) )**(1./n) / alpha
+    return np.where(np.isinf(psi), _psi98(alpha, n, m), psi)
+
+def theta_psi(psi, ths, thr, alpha, n, m=None):
+    r"""Soil moisture (theta) from matric head (psi)"""
+    return theta_thst(thst_psi(psi, alpha, n, m), ths, thr)
+
+@np.errstate(all='ignore')
+def ku_psi(psi, ks, alpha, n, m=None, l=0.5):
+    r"""Unsaturated hydraulic conductivity (ku) from matric head (psi)"""
+    m = _m(n, m)
+    v = 1. + (alpha*np.abs(psi))**n
+    return ks* v**(-1.*m*l) * (1. - (1. - 1/v)**m)**2
+
+@np.errstate(all='ignore')
+def ku_thst(thst, ks, alpha, n, m=None, l=0.5):
+    r"""Unsaturated hydraulic conductivity (ku) from relative saturation (theta*)"""
+    m = _m(n, m)
+    thst = np.asarray(thst, dtype=float)
+    return ks*thst**l * (1 - (1-thst**(1/m))**m)**2
+
+def ku_theta(theta, ths, thr, ks, alpha, n, m=None):
+    r"""Unsaturated hydraulic conductivity (ku) from soil moisture (theta)"""
+    return ku_thst(thst_theta(theta, ths, thr), ks, alpha, n, m)
+
+@np.errstate(all='ignore')
+def c_psi(psi, ths, thr, alpha, n, m=None):
+    r"""Water capacity (c) from matric head (psi)"""
+    m = _m(n, m)
+    return -1.*(ths-thr)*n*m* alpha**n * np.abs(psi)**(n-1.) * (1+(alpha*np.abs(psi))**n)**(-1.*m - 1.)
+
+@np.errstate(all='ignore')
+def D_psi(psi, ks, ths, thr, alpha, n, m=None):
+    r"""Diffusivity (D) from matric head (psi) by a finite difference of 0.05 in psi"""
+    m = _m(n, m)
+    psi = np.asarray(psi, dtype=float)
+    dth = theta_psi(psi, ths, thr, alpha, n, m) - theta_psi(psi-0.05, ths, thr, alpha, n, m)
+    return ku_psi(psi, ks, alpha, n, m)*0.1/dth
+
+@np.errstate(all='ignore')
+def D_thst(thst, ths, thr, ks, alpha, n, m=None):
+    r"""Diffusivity (D) from relative saturation (theta*)"""
+    m = _m(n, m)
+    thst = np.asarray(thst, dtype=float)
+    return (ks*(1.-m)*(thst**(0.5-(1./m)))) / (alpha*m*(ths-thr)) *( (1.-thst**(1./m))**(-1.*m) + (1.-thst**(1./m))**m -2. )
+
+def D_theta(theta, ths, thr, ks, alpha, n, m=None):
+    r"""Diffusivity (D) from soil moisture (theta)"""
+    return D_thst(thst_theta(theta, ths, thr), ths, thr, ks, alpha, n, m)
+
+@np.errstate(all='ignore')
+def dpsidtheta_thst(th_star, ths, thr, alpha, n, m=None):
+    r"""Derivative of matric head by soil moisture from relative saturation (theta*)
+
+    Evaluated as a finite difference of 0.01 in theta* (which is limited to 0.01...0.9899).
+    """
+    th_star = np.clip(th_star, 0.01, 0.9899)
+    th_star1 = th_star-0.01
+    th_star = th_star+0.01
+    theta = theta_thst(th_star, ths, thr)
+    thetast = theta_thst(th_star1, ths, thr)
+    return (psi_thst(th_star1, alpha, n, m)-psi_thst(th_star, alpha, n, m))/(thetast-theta)
+
+@np.errstate(all='ignore')
+def dDdtheta_thst(th_star, ths, thr, ks, alpha, n, m=None):
+    r"""Derivative of diffusivity by soil moisture from relative saturation (theta*)
+
+    Evaluated as a finite difference of 0.01 in theta* (which is limited to 0.01...0.9899).
+    """
+    th_star = np.clip(th_star, 0.01, 0.9899)
+    th_star1 = th_star-0.01
+    th_star = th_star+0.01
+    theta = theta_thst(th_star, ths, thr)
+    thetast = theta_thst(th_star1, ths, thr)
+    return (D_thst(th_star1, ths, thr, ks, alpha, n, m)-D_thst(th_star, ths, thr, ks, alpha, n, m))/(thetast-theta)
+
+@np.errstate(all='ignore')
+def dcst_thst(thst, ths, thr, ks, alpha, n, m=None):
+    r"""Diffusivity (D as ku*dpsi/dthst) from relative saturation (theta*)"""
+    m = _m(n, m)
+    c = c_psi(psi_thst(thst, alpha, n, m), ths, thr, alpha, n, m)
+    return -ku_thst(thst, ks, alpha, n, m)/(c*theta_thst(thst, ths, thr))
+
+
+# look-up tables
+def create_lookup(ths, thr, ks, alpha, n, m=None, resolution=100):
+    r"""Tables of matric head, soil moisture, conductivity and diffusivity of soils
+
+    Parameters
+    ----------
+    ths, thr, ks, alpha, n, m : array_like
+        van Genuchten parameters of the soils (m is derived from n if None)
+    resolution : int
+        number of relative saturation steps in (0, 1]
+
+    Returns
+    -------
+    [psi, theta, ku, D] : list of numpy.ndarray
+        tables (resolution x soils) at relative saturations of 1/resolution...1 (the
+        diffusivity at saturation is set to the one of the step before)
+    """
+    [ths, thr, ks, alpha, n] = [np.atleast_1d(np.asarray(x, dtype=float)) for x in [ths, thr, ks, alpha, n]]
+    m = _m(n, None if m is None else np.atleast_1d(np.asarray(m, dtype=float)))
+    thst = (np.arange(resolution)+1.)[:, None]/resolution
+
+    psi = psi_thst(thst, alpha, n, m)
+    theta = theta_thst(thst, ths, thr) + np.zeros_like(psi)
+    ku = ku_thst(thst, ks, alpha, n, m)
+    D = D_thst(thst, ths, thr, ks, alpha, n, m)
+    D[-1,:] = D[-2,:]
+    return [psi, theta, ku, D]
+
+def _interp(x, xp, fp, soil):
+    # linear interpolation of x in the ascending columns xp (of the soil indices) to fp
+    # (constant beyond the tables, NaN for NaN)
+    x, soil = np.broadcast_arrays(np.asarray(x, dtype=float), np.asarray(soil, dtype=int))
+    out = np.empty(x.shape)
+    for s in np.unique(soil):
+        sel = soil == s
+        xs = x[sel]
+        i = np.clip(np.searchsorted(xp[:, s], xs), 1, len(xp)-1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            w = np.clip((xs - xp[i-1, s]) / (xp[i, s] - xp[i-1, s]), 0., 1.)
+        out[sel] = fp[i-1, s] + w*(fp[i, s]-fp[i-1, s])
+    return out
+
+def _interp_thst(thst, fp, soil):
+    # linear interpolation on the regular grid of relative saturation of create_lookup
+    # (the position in the table follows directly, constant beyond the tables, NaN for NaN)
+    res = fp.shape[0]
+    pos = np.asarray(thst, dtype=float)*res - 1.
+    with np.errstate(invalid='ignore'):
+        np.clip(pos, 0., res - 1., out=pos)
+        i = np.clip(pos.astype(np.intp), 0, res - 2)
+    k = i + np.asarray(soil, dtype=np.intp)*res
+    fp = fp.T.ravel()
+    lo = fp[k]
+    return lo + (pos - i)*(fp[k+1] - lo)
+
+class LookupTable(object):
+    r"""Precomputed van Genuchten tables of several soils for fast conversions
+
+    Conversions interpolate linearly (monotone) in tables of rootwater.vangenuchten.create_lookup
+    with the resolution in relative saturation. Positions in the tables follow directly from 
+    the relative saturation, or are located with numpy.searchsorted for matric heads. 
+    Readings and soil indices broadcast, e.g. a (time steps x sensors) array with one soil 
+    index per sensor.
+
+    Parameters
+    ----------
+    ths, thr, ks, alpha, n, m : array_like
+        van Genuchten parameters of the soils (m is derived from n if None)
+    resolution : int
+        number of relative saturation steps of the tables
+
+    Examples
+    --------
+    >>> lut = LookupTable.from_params(read_params('vG_RWU.csv'), resolution=1000)
+    >>> psi = lut.psi_theta(SM.values, soil=[0, 0, 1, 1])
+    """
+
+    def __init__(self, ths, thr, ks, alpha, n, m=None, resolution=100):
+        self.resolution = resolution
+        self.ths = np.atleast_1d(np.asarray(ths, dtype=float))
+        self.thr = np.atleast_1d(np.asarray(thr, dtype=float))
+        [self.psi, self.theta, self.ku, self.D] = create_lookup(ths, thr, ks, alpha, n, m, resolution)
+
+    def _thst(self, theta, soil):
+        soil = np.asarray(soil, dtype=int)
+        return thst_theta(theta, self.ths[soil], self.thr[soil])
+
+    @classmethod
+    def from_params(cls, params, resolution=100):
+        r"""Tables of the soils (rows) of a parameter frame (see rootwater.vangenuchten.read_params)"""
+        m = params['m'].values if 'm' in params.columns else None
+        return cls(params['ths'].values, params['thr'].values, params['ks'].values,
+                   params['alpha'].values, params['n'].values, m, resolution)
+
+    def psi_theta(self, theta, soil=0):
+        r"""Matric head (psi) from soil moisture (theta) of the soils (indices)"""
+        return _interp_thst(self._thst(theta, soil), self.psi, soil)
+
+    def theta_psi(self, psi, soil=0):
+        r"""Soil moisture (theta) from matric head (psi) of the soils (indices)"""
+        return _interp(psi, self.psi, self.theta, soil)
+
+    def ku_theta(self, theta, soil=0):
+        r"""Unsaturated hydraulic conductivity (ku) from soil moisture (theta) of the soils (indices)"""
+        return _interp_thst(self._thst(theta, soil), self.ku, soil)
+
+    def D_theta(self, theta, soil=0):
+        r"""Diffusivity (D) from soil moisture (theta) of the soils (indices)"""
+        return _interp_thst(self._thst(theta, soil), self.D, soil)
+
+@functools.lru_cache(maxsize=32)
+def _read_params(fname, mtime):
+    params = pd.read_csv(fname, index_col=0).T
+    params = params.drop(index=[i for i in params.index if str(i).lower() == 'unit'])
+    return params.astype(float)
+
+def read_params(fname):
+    r"""Read van Genuchten parameters of soils (like docs/examples/vG_RWU.csv)
+
+    Files are cached (until they are modified), repeated calls return a copy of
+    the parsed table.
+
+    Parameters
+    ----------
+    fname : str
+        csv file with parameters as rows (ths, thr, alpha, n, m, ks) and soils as
+        columns (a unit column is dropped)
+
+    Returns
+    -------
+    params : pandas.DataFrame
+        parameters (columns) of the soils (rows)
+    """
+    fname = os.path.abspath(fname)
+    return _read_params(fname, os.path.getmtime(fname)).copy()
+
+@functools.lru_cache(maxsize=32)
+def _lookup(fname, mtime, resolution):
+    return LookupTable.from_params(_read_params(fname, mtime), resolution)
+
+def lookup(fname, resolution=100):
+    r"""Cached rootwater.vangenuchten.LookupTable of a parameter file (see read_params)"""
+    fname = os.path.abspath(fname)
+    return _lookup(fname, os.path.getmtime(fname), resolution)
+
+class SoilTable(object):
+    r"""Van Genuchten parameters of samples (e.g. sensors) resolved to contiguous arrays
+
+    Replaces the per call lookups of soil parameters (like mc.soilmatrix.<param>[sample] 
+    in the wrappers of vG_conv.py). The parameters are resolved once for the samples and 
+    broadcast along the last axis of the readings, so that a (time steps x samples) array 
+    or data frame is converted in one call.
+
+    Parameters
+    ----------
+    soilmatrix : pandas.DataFrame
+        parameters of soils (rows) with columns ths (or ts), thr (or tr), alpha, n and 
+        optional ks and m (like the result of rootwater.vangenuchten.read_params)
+    sample : array_like
+        soil labels (index of soilmatrix) of the samples (default all soils)
+
+    Examples
+    --------
+    >>> soils = SoilTable(read_params('vG_RWU.csv'), ['Sand 5-30 cm', 'Sand 30-75 cm'])
+    >>> psi = soils.psi_theta(SM[['Sand_SM_10', 'Sand_SM_50']])
+    """
+
+    def __init__(self, soilmatrix, sample=None):
+        soilmatrix = soilmatrix.rename(columns={'ts': 'ths', 'tr': 'thr'})
+        if sample is not None:
+            soilmatrix = soilmatrix.loc[np.atleast_1d(sample)]
+        self.sample = soilmatrix.index
+        for k in ['ths', 'thr', 'alpha', 'n', 'ks']:
+            setattr(self, k, np.ascontiguousarray(soilmatrix[k].values, dtype=float) if k in soilmatrix.columns else None)
+        self.m = _m(self.n, np.ascontiguousarray(soilmatrix['m'].values, dtype=float) if 'm' in soilmatrix.columns else None)
+
+    def __len__(self):
+        return len(self.sample)
+
+    def _apply(self, func, x, *params):
+        # evaluate func for an array or data frame (keeping its labels) of readings
+        if any(p is None for p in params):
+            raise ValueError('missing van Genuchten parameters for '+func.__name__)
+        if isinstance(x, (pd.DataFrame, pd.Series)):
+            res = func(x.values, *params)
+            return x._constructor(res, index=x.index, **({'columns': x.columns} if x.ndim == 2 else {'name': x.name}))
+        return func(x, *params)
+
+    def theta_psi(self, psi):
+        r"""Soil moisture (theta) from matric head (psi)"""
+        return self._apply(theta_psi, psi, self.ths, self.thr, self.alpha, self.n, self.m)
+
+    def psi_theta(self, theta):
+        r"""Matric head (psi) from soil moisture (theta)"""
+        return self._apply(psi_theta, theta, self.ths, self.thr, self.alpha, self.n, self.m)
+
+    def psi_thst(self, thst):
+        r"""Matric head (psi) from relative saturation (theta*)"""
+        return self._apply(psi_thst, thst, self.alpha, self.n, self.m)
+
+    def ku_psi(self, psi):
+        r"""Unsaturated hydraulic conductivity (ku) from matric head (psi)"""
+        return self._apply(ku_psi, psi, self.ks, self.alpha, self.n, self.m)
+
+    def D_psi(self, psi):
+        r"""Diffusivity (D) from matric head (psi)"""
+        return self._apply(D_psi, psi, self.ks, self.ths, self.thr, self.alpha, self.n, self.m)
+
+    def D_thst(self, thst):
+        r"""Diffusivity (D) from relative saturation (theta*)"""
+        return self._apply(D_thst, thst, self.ths, self.thr, self.ks, self.alpha, self.n, self.m)
+
+    def Dku_thst(self, thst):
+        r"""Diffusivity (D), conductivity (ku) and soil moisture (theta) from relative saturation (theta*)"""
+        psi = self.psi_thst(thst)
+        return (self.D_psi(psi), self.ku_psi(psi), self._apply(theta_thst, thst, self.ths, self.thr))
@@ -20,9 +20,11 @@ setup(
     author='Conrad Jackisch',
     author_email='conrad.jackisch@tbt.tu-freiberg.de',
     install_requires=REQUIREMENTS,
+    extras_require={'arrow': ['pyarrow'], 'numba': ['numba']},
     test_require=['nose'],
     test_suite='nose.collector',
-    packages=find_packages(),
+    packages=find_packages(exclude=['benchmarks']),
+    entry_points={'console_scripts': ['rootwater=rootwater.cli:main']},
     include_package_data=True,
     classifiers=[
         "Programming Language :: Python :: 3",